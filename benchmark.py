@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+
+# rnote - a software to take notes in a simple and convenient way
+# Copyright (C) 2019 Robert Imschweiler
+#
+# This file is part of rnote.
+#
+# rnote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rnote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rnote.  If not, see <https://www.gnu.org/licenses/>.
+
+# Benchmarks of the notes store and the undo history. They run on synthetic
+# notes in a temporary directory and print their results as JSON, so that
+# the results of different versions can be compared. The benchmarks of the
+# GTK parts only run if GTK can be initialized (e.g. within xvfb-run).
+
+import contextlib
+import getopt
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import rnote_core as core
+from rnote_core import Edit, Notes, SortedNotes, TimeSortedNotes, \
+        UndoHistory, Worker, format_key_file, version_str
+
+
+# number of notes in the generated stores
+SIZES = [1000, 10000, 100000]
+# number of notes written, renamed and deleted per store at most
+CHANGES = 1000
+# number of characters typed into the text buffer
+TYPED = 20000
+# words of the generated notes
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta',
+        'theta', 'iota', 'kappa', 'lambda', 'mu', 'nu', 'xi', 'omicron', 'pi',
+        'rho', 'sigma', 'tau', 'upsilon', 'phi', 'chi', 'psi', 'omega']
+
+
+def bench_buffer(results):
+    try:
+        import rnote_gui
+        (success, argv) = rnote_gui.Gtk.init_check(None)
+    except Exception:
+        success = False
+    if not success:
+        sys.stderr.write('%s: cannot initialize GTK, skipping the GTK '
+                'benchmarks\n' % sys.argv[0])
+        return
+    worker = Worker()
+    text_buffer = rnote_gui.UndoRedoTextBuffer()
+    text_buffer.set_history(UndoHistory(worker))
+    text = typed_text()
+    with measure(results, 'UndoRedoTextBuffer.insert', len(text)):
+        for char in text:
+            text_buffer.insert_at_cursor(char)
+    steps = 0
+    with measure(results, 'UndoRedoTextBuffer.undo') as result:
+        while text_buffer.history.can_undo():
+            text_buffer.undo(None)
+            steps += 1
+        result['operations'] = steps
+    with measure(results, 'UndoRedoTextBuffer.redo', steps):
+        while text_buffer.history.can_redo():
+            text_buffer.redo(None)
+
+
+def bench_history(results):
+    history = UndoHistory(Worker())
+    text = typed_text()
+    with measure(results, 'UndoHistory.add', len(text)):
+        for (i, char) in enumerate(text):
+            history.add(Edit.INSERT, i, i + 1, char)
+    steps = 0
+    with measure(results, 'UndoHistory.undo') as result:
+        while history.can_undo():
+            history.undo()
+            steps += 1
+        result['operations'] = steps
+    with measure(results, 'UndoHistory.redo', steps):
+        while history.can_redo():
+            history.redo()
+
+
+def bench_overview(results, notes):
+    if 'rnote_gui' not in sys.modules:
+        return
+    import rnote_gui
+    view = rnote_gui.Gtk.TreeView.new()
+    # what Overview.update does with the notes
+    with measure(results, 'Overview.update', len(notes.list),
+            len(notes.list)):
+        view.set_model(rnote_gui.NotesModel(notes.list))
+
+
+def bench_store(results, size):
+    generate(size)
+    changes = min(CHANGES, size)
+    with measure(results, 'Notes.read (cold)', size, size):
+        notes = Notes()
+    notes.write()
+    with measure(results, 'Notes.read (warm)', size, size):
+        notes = Notes()
+    shuffled = list(notes.list)
+    random.shuffle(shuffled)
+    with measure(results, 'sort', size, size):
+        SortedNotes(shuffled)
+    with measure(results, 'sort by time', size, size):
+        TimeSortedNotes(shuffled)
+    bench_overview(results, notes)
+    names = ['new note %d' % i for i in range(changes)]
+    with measure(results, 'note_write', changes, size):
+        for name in names:
+            notes.note_write(name, ' '.join(random.sample(WORDS, 10)))
+        notes.worker.flush()
+    with measure(results, 'note_rename', changes, size):
+        for name in names:
+            notes.note_rename(name, 'renamed ' + name)
+        notes.worker.flush()
+    with measure(results, 'note_delete', changes, size):
+        for name in names:
+            notes.note_delete('renamed ' + name)
+        notes.worker.flush()
+    notes.write()
+
+
+# Create the notes and their names directly, without any caches.
+def generate(size):
+    shutil.rmtree(core.app_dir)
+    core.setup()
+    names = {}
+    for i in range(size):
+        filename = 'note_%032x' % i
+        with open(os.path.join(core.notes_dir, filename), 'w') as f:
+            f.write(' '.join(random.choices(WORDS, k=40)))
+        names[filename] = 'note %d %s' % (i, random.choice(WORDS))
+    with open(core.data_file, 'w') as f:
+        f.write(format_key_file({'NotesNames': names}))
+
+
+# Time the block and add the result. The number of operations might also be
+# set within the block (see bench_history).
+@contextlib.contextmanager
+def measure(results, name, operations=1, notes=None):
+    result = {'name': name, 'notes': notes, 'operations': operations}
+    start = time.perf_counter()
+    yield result
+    seconds = time.perf_counter() - start
+    result['seconds'] = seconds
+    result['operations_per_second'] = (result['operations'] / seconds
+            if seconds else None)
+    results.append(result)
+
+
+def typed_text():
+    words = random.choices(WORDS, k=TYPED // 6)
+    return ' '.join(words)[:TYPED]
+
+
+def usage():
+    print('usage: ' + sys.argv[0] + ' [options]\n'
+            '  -h --help\t\tprint this help\n'
+            '  -o --output FILE\twrite the results to FILE instead of the '
+            'standard output\n'
+            '  -s --sizes N,...\tthe numbers of notes of the stores '
+            '(default: %s)' % ','.join(map(str, SIZES))
+            )
+
+
+def main():
+    sizes = SIZES
+    output = None
+    try:
+        (opts, args) = getopt.getopt(sys.argv[1:], 'ho:s:',
+                [ 'help', 'output=', 'sizes=', ])
+        for o, a in opts:
+            if o in ('-h', '--help'):
+                usage()
+                sys.exit(0)
+            elif o in ('-o', '--output'):
+                output = a
+            elif o in ('-s', '--sizes'):
+                sizes = [int(size) for size in a.split(',')]
+    except (getopt.GetoptError, ValueError) as err:
+        core.die(err)
+    if args:
+        core.die('unhandled option(s): %s' % ' '.join(args))
+    # the same notes for every run
+    random.seed(0)
+    results = []
+    tmp = tempfile.mkdtemp(prefix='rnote_bench_')
+    os.environ['HOME'] = tmp
+    try:
+        core.setup()
+        bench_history(results)
+        bench_buffer(results)
+        for size in sizes:
+            bench_store(results, size)
+    finally:
+        shutil.rmtree(tmp)
+    report = {
+            'version': version_str,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results,
+            }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+main()
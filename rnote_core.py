@@ -0,0 +1,2277 @@
+#!/usr/bin/python3
+
+# rnote - a software to take notes in a simple and convenient way
+# Copyright (C) 2019 Robert Imschweiler
+#
+# This file is part of rnote.
+#
+# rnote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rnote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rnote.  If not, see <https://www.gnu.org/licenses/>.
+
+# The part of rnote which does not depend on GTK: the notes themselves, their
+# caches, the journal and the undo history. It is used by both the graphical
+# interface and the command line.
+
+import array
+import bisect
+import collections
+import contextlib
+import datetime
+import difflib
+import fcntl
+import functools
+import hashlib
+import io
+import json
+import logging
+import logging.handlers
+import math
+import mmap
+import operator
+import os
+import re
+import socket
+import sqlite3
+import struct
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+
+
+app_name = 'rnote'
+version_str = 'version 0.1.0'
+
+
+# global variables
+app_dir = '.' + app_name
+notes_dir = 'notes'
+config_file = 'config'
+data_file = 'data'
+history_dir = 'history'
+index_file = 'index'
+journal_file = 'journal'
+lines_dir = 'lines'
+lock_file = 'lock'
+revisions_dir = 'revisions'
+search_file = 'search'
+socket_file = 'socket'
+store_file = 'store'
+timings_file = 'timings.log'
+# the instrumentation (see Timings), or None
+timings = None
+# the startup profile (see --profile-startup): a list of the measured steps
+# and their durations in seconds, or None
+profile = None
+start_time = time.perf_counter()
+# constants
+# the PAX header of an archived note which contains its name (see
+# archive_write)
+archive_name_header = 'RNOTE.name'
+archive_tags_header = 'RNOTE.tags'
+# bytes read at once from a note or an archive member
+chunk_size = 65536
+key_file_escapes = {'s': ' ', 'n': '\n', 't': '\t', 'r': '\r', '\\': '\\'}
+copyright = 'Copyright (C) 2019 Robert Imschweiler'
+description = 'A software to take notes in a simple and convenient way.'
+license_short = 'License GPLv3+: GNU GPL version 3 or later '\
+        '<https://gnu.org/licenses/gpl.html>'
+license = '''Copyright (C) 2019 Robert Imschweiler
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.'''
+
+
+# The offsets of the lines of a note, so that any line of the memory mapped
+# note can be found at once. The offsets are stored in a cache file next to
+# the modification time and the size of the note, and the cache file is
+# memory mapped as well. It is only rebuilt when the note has changed.
+class LineIndex:
+    HEADER = struct.Struct('=qq')
+
+    def __init__(self, path, cache_path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.cache = None
+        try:
+            stat = os.fstat(self.file.fileno())
+            self.size = stat.st_size
+            # an empty file cannot be mapped
+            self.data = (mmap.mmap(self.file.fileno(), 0,
+                access=mmap.ACCESS_READ) if self.size else b'')
+            header = self.HEADER.pack(stat.st_mtime_ns, stat.st_size)
+            if not self.__read_cache(cache_path, header):
+                self.__build(cache_path, header)
+                self.__read_cache(cache_path, header)
+        except:
+            self.close()
+            raise
+
+    def __build(self, cache_path, header):
+        # the starts of all lines but the first one
+        offsets = array.array('Q',
+                (match.end() for match in re.finditer(b'\n', self.data)))
+        write_atomic(cache_path, [header, offsets.tobytes()])
+
+    def close(self):
+        if self.cache:
+            self.offsets.release()
+            self.cache.close()
+            self.cache = None
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __len__(self):
+        return len(self.offsets) + 1
+
+    # Returns the line without its newline, cut after "limit" bytes.
+    def line(self, i, limit):
+        start = self.offsets[i-1] if i else 0
+        end = self.offsets[i] - 1 if i < len(self.offsets) else self.size
+        return self.data[start:min(end, start + limit)]
+
+    def __read_cache(self, cache_path, header):
+        try:
+            with open(cache_path, 'rb') as f:
+                if f.read(len(header)) != header:
+                    return False
+                self.cache = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        self.offsets = memoryview(self.cache)[len(header):].cast('Q')
+        return True
+
+
+# One entry of the undo history. Adjacent single characters typed or deleted
+# in a row are merged into one entry, which ends with the first word after
+# some whitespace.
+class Edit:
+    # enum
+    INSERT = 1
+    DELETE = 2
+
+    __slots__ = ('action', 'end', 'start', 'text')
+
+    def __init__(self, action, start, end, text):
+        self.action = action
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def merge(self, action, start, end, text):
+        if action != self.action or len(text) != 1:
+            return False
+        if action == self.INSERT and start == self.end:
+            append = True
+        elif action == self.DELETE and start == self.start:
+            # the delete key
+            append = True
+        elif action == self.DELETE and end == self.start:
+            # the backspace key
+            append = False
+        else:
+            return False
+        edge = self.text[-1] if append else self.text[0]
+        if edge.isspace() and not text.isspace():
+            return False
+        if append:
+            self.text += text
+        else:
+            self.text = text + self.text
+            self.start = start
+        self.end = self.start + len(self.text)
+        return True
+
+
+# The undo history of a note, made up of Edit entries. All changes of the
+# history are logged as records (see "apply"), which are appended to the log
+# file of the note whenever the note is saved, followed by a record with the
+# hash of the saved content. The log only fits the note if it ends with the
+# hash of its current content.
+# The log is only read when the user wants to undo further than the changes
+# made since the note has been opened. Until then, these changes are kept in
+# "session", to be replayed on top of the log.
+class UndoHistory:
+    # limits of the history; the oldest entries are dropped first
+    MAX_ENTRIES = 1000
+    MAX_SIZE = 1 << 20
+    # size of the log file from which on it is rewritten in compact form
+    COMPACT_SIZE = 1 << 21
+    # number of changes in "session" from which on the log is read anyway
+    SESSION_MAX = 10000
+
+    def __init__(self, worker, path=None, content_hash=None):
+        self.worker = worker
+        self.path = path
+        self.undo_stack = collections.deque()
+        self.redo_stack = []
+        self.size = 0
+        self.lock = threading.Lock()
+        self.pending = []
+        # the log of another note might be at the path of the first save
+        self.truncate = True
+        self.unsaved = []
+        self.session = []
+        self.loaded = True
+        self.log_size = 0
+        if path:
+            # pending writes of the log might still be in the queue
+            worker.flush()
+            try:
+                self.log_size = os.path.getsize(path)
+                self.loaded = self.__last_hash() != content_hash
+            except (OSError, ValueError, IndexError):
+                pass
+            # a log which does not fit the note is replaced
+            self.truncate = self.loaded
+        self.offset = self.log_size
+
+    # Returns the Edit undone or redone, or for an edit whether it has been
+    # merged into the last entry.
+    def apply(self, record):
+        if record[0] in ('edit', 'group'):
+            (action, start, end, text) = record[1:]
+            merged = bool(record[0] == 'edit' and self.undo_stack
+                    and self.undo_stack[-1].merge(action, start, end, text))
+            if not merged:
+                self.undo_stack.append(Edit(action, start, end, text))
+            self.size += len(text)
+            while (len(self.undo_stack) > self.MAX_ENTRIES
+                    or (self.size > self.MAX_SIZE
+                        and len(self.undo_stack) > 1)):
+                self.size -= len(self.undo_stack.popleft().text)
+            self.redo_stack = []
+            return merged
+        elif record[0] == 'undo' and self.undo_stack:
+            edit = self.undo_stack.pop()
+            self.size -= len(edit.text)
+            self.redo_stack.append(edit)
+            return edit
+        elif record[0] == 'redo' and self.redo_stack:
+            edit = self.redo_stack.pop()
+            self.size += len(edit.text)
+            self.undo_stack.append(edit)
+            return edit
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def can_undo(self):
+        return bool(self.undo_stack) or not self.loaded
+
+    def __flush(self):
+        with self.lock:
+            (lines, self.pending) = (self.pending, [])
+            truncate = self.truncate
+            self.truncate = False
+        if truncate:
+            write_atomic(self.path, ''.join(lines).encode())
+            return
+        with open(self.path, 'a') as f:
+            f.writelines(lines)
+
+    def __last_hash(self):
+        with open(self.path, 'rb') as f:
+            f.seek(max(0, self.log_size - 256))
+            lines = f.read().splitlines()
+        record = json.loads(lines[-1].decode())
+        return record[1] if record[0] == 'saved' else None
+
+    def load(self):
+        self.loaded = True
+        (session, self.session) = (self.session, [])
+        records = []
+        try:
+            with open(self.path, 'rb') as f:
+                # only the part written before the note has been opened
+                for line in f.read(self.offset).splitlines():
+                    records.append(json.loads(line.decode()))
+        except (OSError, ValueError):
+            self.truncate = True
+            records = []
+        self.undo_stack = collections.deque()
+        self.redo_stack = []
+        self.size = 0
+        for record in records + session:
+            self.apply(record)
+
+    def __record(self, record):
+        if not self.loaded and len(self.session) >= self.SESSION_MAX:
+            self.load()
+        result = self.apply(record)
+        if not self.loaded:
+            self.session.append(record)
+        self.unsaved.append(record)
+        return result
+
+    # An edit is only logged as such if it has been merged here, so that the
+    # log is replayed into the same entries, even where the log (which might
+    # not have been read) ends with an entry which it could be merged into.
+    # The record is changed in place, as it has been logged already.
+    def add(self, action, start, end, text):
+        record = ['edit', action, start, end, text]
+        if not self.__record(record):
+            record[0] = 'group'
+
+    def redo(self):
+        return self.__record(['redo'])
+
+    # Write the changes since the last save to the log of the note, whose
+    # saved content has the hash "content_hash". A big log is replaced by
+    # records which create the current history directly.
+    def save(self, path, content_hash):
+        if not self.path:
+            self.path = path
+        lines = [json.dumps(record) + '\n' for record in self.unsaved]
+        lines.append(json.dumps(['saved', content_hash]) + '\n')
+        self.unsaved = []
+        self.log_size += sum(len(line) for line in lines)
+        truncate = False
+        if self.truncate or self.log_size > self.COMPACT_SIZE:
+            if not self.loaded:
+                self.load()
+            records = [['group', edit.action, edit.start, edit.end, edit.text]
+                    for edit in self.undo_stack]
+            records += [['group', edit.action, edit.start, edit.end, edit.text]
+                    for edit in reversed(self.redo_stack)]
+            records += [['undo']] * len(self.redo_stack)
+            records.append(['saved', content_hash])
+            lines = [json.dumps(record) + '\n' for record in records]
+            self.log_size = sum(len(line) for line in lines)
+            truncate = True
+        with self.lock:
+            if truncate:
+                self.pending = lines
+                self.truncate = True
+            else:
+                self.pending += lines
+        self.worker.submit(self.path, self.__flush)
+
+    def undo(self):
+        if not self.undo_stack and not self.loaded:
+            self.load()
+        if not self.undo_stack:
+            return None
+        return self.__record(['undo'])
+
+
+# The saved versions of a note, appended to a pack file of their own. A
+# version is stored as a delta against the previous one (see delta_create),
+# and every KEYFRAME_INTERVAL versions in full, so that any version can be
+# restored with a bounded number of deltas. Every record is compressed. The
+# oldest versions are dropped when the pack has grown too long, so its size
+# stays proportional to the note.
+class RevisionPack:
+    # kind, modification time in nanoseconds, size of the version, size of
+    # the record
+    HEADER = struct.Struct('=BqQI')
+    # enum
+    KEYFRAME = 0
+    DELTA = 1
+    KEYFRAME_INTERVAL = 16
+    # number of versions from which on the pack is compacted, and the number
+    # of versions kept then
+    MAX_REVISIONS = 200
+    KEEP_REVISIONS = 150
+    # larger notes have no history, as they could not be compared quickly
+    MAX_NOTE_SIZE = 1 << 24
+
+    def __init__(self, path):
+        self.path = path
+
+    # Records a new version unless it equals the latest one.
+    def add(self, content, mtime_ns):
+        with self.__locked():
+            records = self.__records()
+            kind = self.KEYFRAME
+            payload = content
+            if records:
+                latest = self.get(len(records) - 1, records)
+                if latest == content:
+                    return
+                since_keyframe = 0
+                for record in reversed(records):
+                    if record[0] == self.KEYFRAME:
+                        break
+                    since_keyframe += 1
+                if since_keyframe + 1 < self.KEYFRAME_INTERVAL:
+                    delta = delta_create(latest, content)
+                    # a delta of a completely rewritten note is no gain
+                    if len(delta) < len(content):
+                        (kind, payload) = (self.DELTA, delta)
+            with open(self.path, 'ab') as f:
+                # drop a record which has been written incompletely
+                f.truncate(records[-1][4] + records[-1][3] if records else 0)
+                f.write(self.__record(kind, mtime_ns, len(content), payload))
+            if len(records) + 1 > self.MAX_REVISIONS:
+                self.__compact(self.KEEP_REVISIONS)
+
+    def compact(self, keep):
+        with self.__locked():
+            self.__compact(keep)
+
+    # Write the latest "keep" versions into a new pack, starting with a
+    # keyframe. The versions are written while they are read, so only two of
+    # them are held at a time.
+    def __compact(self, keep):
+        records = self.__records()
+        if keep <= 0 or not records:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+
+        def data():
+            previous = None
+            versions = self.__versions(records, max(0, len(records) - keep))
+            for (i, (mtime_ns, content)) in enumerate(versions):
+                if i % self.KEYFRAME_INTERVAL:
+                    yield self.__record(self.DELTA, mtime_ns, len(content),
+                            delta_create(previous, content))
+                else:
+                    yield self.__record(self.KEYFRAME, mtime_ns,
+                            len(content), content)
+                previous = content
+
+        write_atomic(self.path, data())
+
+    # Returns the content of version i. The records may be given if they have
+    # been read already.
+    def get(self, i, records=None):
+        if records is None:
+            records = self.__records()
+        if not 0 <= i < len(records):
+            raise IndexError('no such version: %d' % i)
+        start = i
+        while records[start][0] != self.KEYFRAME:
+            start -= 1
+        with open(self.path, 'rb') as f:
+            content = None
+            for (kind, mtime_ns, size, length, offset) in \
+                    records[start:i + 1]:
+                f.seek(offset)
+                payload = zlib.decompress(f.read(length))
+                if kind == self.KEYFRAME:
+                    content = payload
+                else:
+                    content = delta_apply(content, payload)
+        return content
+
+    # Writers lock the pack itself, so that the packs of different notes are
+    # written independently. The pack might have been replaced (see
+    # __compact) or removed while waiting, then the new one is locked.
+    @contextlib.contextmanager
+    def __locked(self):
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            except:
+                os.close(fd)
+                raise
+            os.close(fd)
+        try:
+            yield
+        finally:
+            os.close(fd)
+
+    def __record(self, kind, mtime_ns, size, payload):
+        payload = zlib.compress(payload)
+        return self.HEADER.pack(kind, mtime_ns, size, len(payload)) + payload
+
+    # Returns (kind, mtime_ns, size, length, offset) of every complete record.
+    def __records(self):
+        records = []
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return records
+        with f:
+            end = os.fstat(f.fileno()).st_size
+            offset = 0
+            while offset + self.HEADER.size <= end:
+                header = f.read(self.HEADER.size)
+                (kind, mtime_ns, size, length) = self.HEADER.unpack(header)
+                offset += self.HEADER.size
+                if offset + length > end:
+                    break
+                records.append((kind, mtime_ns, size, length, offset))
+                offset += length
+                f.seek(offset)
+        return records
+
+    # Returns the modification time and the size of every version.
+    def revisions(self):
+        return [(mtime_ns, size)
+                for (kind, mtime_ns, size, length, offset) in self.__records()]
+
+    # Yields the modification time and the content of the versions from
+    # "start" on, the oldest first, applying every delta only once. Only the
+    # records from the keyframe before "start" on are read.
+    def __versions(self, records, start=0):
+        first = start
+        while records[first][0] != self.KEYFRAME:
+            first -= 1
+        content = None
+        with open(self.path, 'rb') as f:
+            for (i, (kind, mtime_ns, size, length, offset)) in \
+                    enumerate(records[first:], first):
+                f.seek(offset)
+                payload = zlib.decompress(f.read(length))
+                if kind == self.KEYFRAME:
+                    content = payload
+                else:
+                    content = delta_apply(content, payload)
+                if i >= start:
+                    yield (mtime_ns, content)
+
+
+# The modification time is kept as a number (see format_time), the tags as a
+# frozenset.
+class Note:
+    __slots__ = ('filename', 'hash', 'key', 'mtime', 'name', 'tags')
+
+    def __init__(self, filename, name=None, mtime=None, content_hash=None,
+            tags=frozenset()):
+        self.filename = filename
+        self.hash = content_hash
+        self.mtime = mtime
+        self.tags = tags
+        self.rename(name)
+
+    def rename(self, name):
+        self.name = name
+        # the sort key is cached, as it is needed for every comparison
+        self.key = (name.lower(), name) if name else None
+
+
+# The notes are accessible by name through the "names" dictionary, while the
+# "list" contains the same notes sorted by name.
+# Every change is reported to the "inform" callback together with the
+# affected note and its old and new position in the list, so that views can
+# update the corresponding rows only.
+class Notes:
+    # enum
+    INSERTED = 1
+    REMOVED = 2
+    RENAMED = 3
+    TOUCHED = 4
+
+    def __init__(self, inform=None):
+        self.inform = inform
+        self.worker = Worker()
+        # the database is used instead of the notes directory once the notes
+        # have been migrated into it (see migrate)
+        if os.path.exists(store_file):
+            self.store = DatabaseStore(store_file)
+        else:
+            self.store = FileStore()
+        self.index = NotesIndex(index_file)
+        self.search_index = SearchIndex(search_file)
+        # the title index is only built when it is used for the first time
+        self.title_index = None
+        # (mtime, size) of the data file as read or written by ourselves
+        self.names_stat = None
+        # the names and tags which have been changed since the data file has
+        # been written the last time, None for a removed note (see
+        # __write_names)
+        self.names_changes = {}
+        self.names_lock = threading.Lock()
+        # whether the index and the names are written at the end of a batch
+        # of changes, or otherwise None (see batch)
+        self.batched = None
+        start = time.perf_counter()
+        self.read()
+        profile_add('Notes.read', start)
+
+    def __hash(self, filename=None, content=None):
+        if filename:
+            with self.store.open(filename) as f:
+                content = f.read()
+        return hashlib.sha1(content).hexdigest()
+
+    # Bring the search index up to date with the notes which have been
+    # changed outside of rnote (or before the search index existed).
+    def __index_search(self, hashes):
+        indexed = self.search_index.hashes()
+        for filename in indexed.keys() - hashes.keys():
+            self.search_index.remove(filename)
+        for (filename, content_hash) in hashes.items():
+            if indexed.get(filename) == content_hash:
+                continue
+            with io.TextIOWrapper(self.store.open(filename),
+                    encoding='utf-8', errors='replace') as f:
+                chunks = iter(functools.partial(f.read, chunk_size), '')
+                self.search_index.update(filename, content_hash,
+                        count_tokens(chunks))
+        self.search_index.commit()
+
+    def __index_note(self, filename, content_hash=None, data=None):
+        if data is None:
+            self.search_index.remove(filename)
+        else:
+            self.search_index.update(filename, content_hash, count_tokens(
+                chunk.decode(errors='replace') for chunk in data))
+        self.search_index.commit()
+
+    # Build the index of the names for filter. This takes a while for many
+    # notes, so the interface does it right after reading them, in the
+    # background.
+    def index_titles(self):
+        self.title_index = TitleIndex(self.list)
+
+    # Defer committing the index and writing the names until the end of many
+    # changes in a row, like an import.
+    @contextlib.contextmanager
+    def batch(self):
+        if self.batched is not None:
+            yield
+            return
+        self.batched = set()
+        try:
+            yield
+        finally:
+            (batched, self.batched) = (self.batched, None)
+            if 'index' in batched:
+                self.__commit_index()
+            if 'names' in batched:
+                self.__write_names()
+
+    # The index is committed by the worker, so that several changes share a
+    # commit and the interface does not wait for it.
+    def __commit_index(self):
+        if self.batched is not None:
+            self.batched.add('index')
+            return
+        self.worker.submit('index', self.index.commit)
+
+    def __emit(self, event, note, old=None, new=None):
+        if self.inform:
+            self.inform(event, note, old, new)
+
+    # Move all notes into the database (see DatabaseStore) or back into the
+    # notes directory. The new storage is complete before the old one is
+    # removed, so that an interrupted migration does not lose any note.
+    # Returns False if the notes are stored this way already.
+    def migrate(self, database):
+        if database == isinstance(self.store, DatabaseStore):
+            return False
+        self.worker.flush()
+        if database:
+            tmp = store_file + '.tmp'
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            store = DatabaseStore(tmp)
+        else:
+            store = FileStore()
+        for note in self.list:
+            (mtime_ns, size) = self.store.stat(note.filename)
+            with self.store.open(note.filename) as f:
+                data = list(iter(functools.partial(f.read, chunk_size), b''))
+            store.write(note.filename, data, note.hash, mtime_ns)
+        if database:
+            store.close()
+            os.replace(tmp, store_file)
+            self.store.close()
+            self.store = DatabaseStore(store_file)
+            # only the files which have been moved into the store
+            for note in self.list:
+                os.remove(os.path.join(notes_dir, note.filename))
+        else:
+            self.store.close()
+            os.remove(store_file)
+            self.store = store
+        # the notes directory has to be read again
+        self.index.set_meta('dir-mtime', None)
+        self.index.commit()
+        return True
+
+    # The list is already in order, so it is quicker to pick the matches from
+    # it than to sort them.
+    def filter(self, text):
+        if not self.title_index:
+            self.index_titles()
+        matches = self.title_index.search(text)
+        return [note for note in self.list if note in matches]
+
+    # Returns the notes which have all (or any) of the tags, in the usual
+    # order. Only the notes with these tags are looked at.
+    def filter_tags(self, tags, match_all=True):
+        sets = sorted((self.tags.get(tag, set()) for tag in set(tags)),
+                key=len)
+        if not sets:
+            return list(self.list)
+        if match_all:
+            notes = sets[0].intersection(*sets[1:])
+        else:
+            notes = set().union(*sets)
+        return sorted(notes, key=lambda note: note.key)
+
+    def note_delete(self, name):
+        self.__remove(self.names[name])
+        self.__write_names()
+
+    def note_get(self, name):
+        with timed('note_get'), self.note_open(name) as f:
+            return f.read().decode(errors='replace')
+
+    def __insert(self, note):
+        self.names[note.name] = note
+        self.files[note.filename] = note
+        if self.title_index:
+            self.title_index.add(note)
+        i = self.list.add(note)
+        self.__name_changed(note)
+        self.__write_names()
+        self.__emit(self.INSERTED, note, new=i)
+
+    # The note file itself is kept if it has been removed by another program
+    # already.
+    def __remove(self, note, remove_file=True):
+        del self.names[note.name]
+        self.__untag(note)
+        i = self.list.remove(note)
+        if self.title_index:
+            self.title_index.remove(note)
+        self.__emit(self.REMOVED, note, old=i)
+        del self.files[note.filename]
+        history = os.path.join(history_dir, note.filename)
+        lines = os.path.join(lines_dir, note.filename)
+        revisions = os.path.join(revisions_dir, note.filename)
+
+        # the note might have been deleted before it has been written
+        def remove():
+            if remove_file:
+                self.store.remove(note.filename)
+            for filename in (history, lines, revisions):
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+        self.worker.submit(('note', note.filename), remove)
+        self.index.remove(note.filename)
+        self.__commit_index()
+        self.__name_changed(note, removed=True)
+        self.worker.submit(('search', note.filename),
+                functools.partial(self.__index_note, note.filename))
+
+    # Replace the tags of the note. Raises ValueError for an invalid tag.
+    def note_tag(self, name, tags):
+        tags = check_tags(tags)
+        note = self.names[name]
+        if tags == note.tags:
+            return
+        self.__tag(note, tags)
+        self.__commit_index()
+        self.__write_names()
+
+    # The file itself is created by the first write.
+    def __note_new(self, name):
+        while True:
+            filename = 'note_' + uuid.uuid4().hex
+            if filename not in self.files:
+                return Note(filename, name)
+
+    # Returns the content of the note as a binary file object.
+    def note_open(self, name):
+        return self.store.open(self.names[name].filename)
+
+    def note_rename(self, oldname, name):
+        if name == oldname:
+            return
+        # renaming a note to the name of another one overwrites the latter
+        if name in self.names:
+            self.note_delete(name)
+        self.__rename(self.names[oldname], name)
+        self.__write_names()
+
+    def __tag(self, note, tags):
+        self.__untag(note)
+        note.tags = tags
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(note)
+        self.index.set_tags(note.filename, tags)
+        self.__name_changed(note)
+        i = self.list.index(note)
+        self.__emit(self.TOUCHED, note, old=i, new=i)
+
+    def __untag(self, note):
+        for tag in note.tags:
+            notes = self.tags[tag]
+            notes.discard(note)
+            if not notes:
+                del self.tags[tag]
+
+    def __rename(self, note, name):
+        del self.names[note.name]
+        if self.title_index:
+            self.title_index.remove(note)
+        (i, j) = self.list.rename(note, name)
+        self.names[name] = note
+        if self.title_index:
+            self.title_index.add(note)
+        self.index.rename(note.filename, name)
+        self.__commit_index()
+        self.__name_changed(note)
+        self.__emit(self.RENAMED, note, old=i, new=j)
+
+    # The note is written in the background. Its modification time is chosen
+    # here (and set by the worker), so that the index can be updated at once.
+    # The content may be given as an iterable of strings (or of already
+    # encoded bytes), which are encoded one by one, so that a huge note is
+    # never copied as a whole.
+    def note_write(self, name, content, mtime_ns=None):
+        with timed('note_write'):
+            note = self.names.get(name)
+            new = note is None
+            if new:
+                note = self.__note_new(name)
+            if isinstance(content, str):
+                content = [content]
+            data = []
+            digest = hashlib.sha1()
+            for chunk in content:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                data.append(chunk)
+                digest.update(data[-1])
+            content_hash = digest.hexdigest()
+            note.hash = content_hash
+            if mtime_ns is None:
+                mtime_ns = time.time_ns()
+            st_mtime = mtime_from_ns(mtime_ns)
+            self.worker.submit(('note', note.filename),
+                    functools.partial(self.__write_note, note.filename, data,
+                        content_hash, mtime_ns))
+            note.mtime = st_mtime
+            self.index.update(note.filename, name, st_mtime,
+                    sum(len(chunk) for chunk in data), content_hash)
+            self.__commit_index()
+            self.worker.submit(('search', note.filename),
+                    functools.partial(self.__index_note, note.filename,
+                        content_hash, data))
+            if new:
+                self.__insert(note)
+            else:
+                i = self.list.index(note)
+                self.__emit(self.TOUCHED, note, old=i, new=i)
+
+    # Every version written is recorded in the revision pack of the note.
+    def __write_note(self, filename, data, content_hash, mtime_ns):
+        self.store.write(filename, data, content_hash, mtime_ns)
+        self.__add_revision(filename, data, mtime_ns)
+
+    def __add_revision(self, filename, data, mtime_ns):
+        if sum(len(chunk) for chunk in data) > RevisionPack.MAX_NOTE_SIZE:
+            return
+        RevisionPack(os.path.join(revisions_dir, filename)).add(
+                b''.join(data), mtime_ns)
+
+    # Returns the modification time (in nanoseconds) and the size of every
+    # saved version of the note, the oldest first.
+    def note_revisions(self, name):
+        filename = self.names[name].filename
+        self.worker.flush()
+        return RevisionPack(os.path.join(revisions_dir, filename)).revisions()
+
+    # Returns the content of a saved version (see note_revisions).
+    def note_revision(self, name, i):
+        filename = self.names[name].filename
+        self.worker.flush()
+        return RevisionPack(os.path.join(revisions_dir, filename)).get(i)
+
+    # Keep only the latest "keep" versions of every note and drop the packs
+    # of notes which do not exist any more. Returns the number of bytes freed.
+    def prune_revisions(self, keep):
+        self.worker.flush()
+        freed = 0
+        for filename in os.listdir(revisions_dir):
+            path = os.path.join(revisions_dir, filename)
+            size = os.path.getsize(path)
+            if filename not in self.files:
+                os.remove(path)
+                freed += size
+                continue
+            RevisionPack(path).compact(keep)
+            if os.path.exists(path):
+                size -= os.path.getsize(path)
+            freed += size
+        return freed
+
+    # Give a unique name to every note whose name is missing or has already
+    # been taken by another note.
+    def repair_names(self, notes):
+        self.names = {}
+        for note in notes:
+            name = note.name
+            while not name or name in self.names:
+                name = (note.name or 'unnamed_note') + '_' + uuid.uuid4().hex
+            if name != note.name:
+                note.rename(name)
+                self.index.rename(note.filename, name)
+                self.__name_changed(note)
+            self.names[name] = note
+
+    def read(self):
+        notes = []
+        hashes = {}
+        entries = self.index.entries()
+        # Reading the directory is only necessary if notes have been added or
+        # removed. Otherwise, the index already knows all the file names.
+        # The database knows the hashes of the notes as well.
+        dir_mtime = os.stat(notes_dir).st_mtime
+        stored = None
+        if isinstance(self.store, DatabaseStore):
+            stored = self.store.entries()
+            stats = [(filename, mtime_from_ns(mtime_ns), size)
+                    for (filename, (mtime_ns, size, content_hash))
+                    in stored.items()]
+        elif dir_mtime == self.index.get_meta('dir-mtime'):
+            stats = self.__stat_all(entries)
+        else:
+            with os.scandir(notes_dir) as _dir:
+                stats = [(entry.name, entry.stat()) for entry in _dir]
+                stats = [(filename, stat.st_mtime, stat.st_size)
+                        for (filename, stat) in stats]
+        # The names and tags only need to be looked up if the data file has
+        # changed since the index has been updated the last time.
+        try:
+            data_stat = os.stat(data_file)
+            data_mtime = data_stat.st_mtime
+            self.names_stat = (data_stat.st_mtime_ns, data_stat.st_size)
+        except OSError:
+            data_mtime = None
+        names = None
+        if data_mtime != self.index.get_meta('data-mtime'):
+            try:
+                names = read_data_file(data_file)
+            except (OSError, ValueError):
+                names = None
+        if names is None:
+            tags = self.index.tags()
+        else:
+            tags = {filename: note_tags
+                    for (filename, (name, note_tags)) in names.items()
+                    if note_tags}
+            self.index.replace_tags(tags)
+        for (filename, st_mtime, size) in stats:
+            entry = entries.pop(filename, None)
+            if names is not None:
+                name = names.get(filename, (None, None))[0]
+            elif entry:
+                name = entry[0]
+            else:
+                name = None
+            if not entry or entry[1] != st_mtime or entry[2] != size:
+                if stored:
+                    hashes[filename] = stored[filename][2]
+                else:
+                    hashes[filename] = self.__hash(filename=filename)
+                self.index.update(filename, name, st_mtime, size,
+                        hashes[filename])
+            else:
+                hashes[filename] = entry[3]
+                if name != entry[0]:
+                    self.index.rename(filename, name)
+            notes.append(Note(filename, name, st_mtime, hashes[filename],
+                tags.get(filename, frozenset())))
+        # remove the notes which have been deleted in the meantime
+        for filename in entries:
+            self.index.remove(filename)
+        self.index.set_meta('dir-mtime', dir_mtime)
+        self.index.set_meta('data-mtime', data_mtime)
+        self.repair_names(notes)
+        self.list = SortedNotes(notes)
+        self.files = {note.filename: note for note in notes}
+        self.tags = {}
+        for note in notes:
+            for tag in note.tags:
+                self.tags.setdefault(tag, set()).add(note)
+        self.title_index = None
+        self.index.commit()
+        self.__index_search(hashes)
+
+    # Bring the notes up to date with the changes made by other programs (see
+    # the watcher of the overview). Only the given files of the notes
+    # directory are looked at, and the names are only read again if the data
+    # file has been changed. Files which are about to be written by the worker
+    # are left alone, since their changes are our own. Returns the file names
+    # of the notes whose content has been changed or which have been removed.
+    def refresh(self, filenames, names_changed=False):
+        changed = set()
+        if not isinstance(self.store, FileStore):
+            return changed
+        names = None
+        if names_changed and not self.worker.pending(data_file):
+            try:
+                stat = os.stat(data_file)
+                if (stat.st_mtime_ns, stat.st_size) != self.names_stat:
+                    names = read_data_file(data_file)
+                    self.names_stat = (stat.st_mtime_ns, stat.st_size)
+            except (OSError, ValueError):
+                pass
+        for filename in filenames:
+            if self.worker.pending(('note', filename)):
+                continue
+            note = self.files.get(filename)
+            try:
+                stat = os.stat(os.path.join(notes_dir, filename))
+            except OSError:
+                stat = None
+            if not stat:
+                if note:
+                    self.__remove(note, remove_file=False)
+                    changed.add(filename)
+                continue
+            # the index is shared with the other instances, so the note might
+            # have been indexed by the one which has changed it
+            entry = self.index.get(filename)
+            data = None
+            if entry and entry[1] == stat.st_mtime and entry[2] == stat.st_size:
+                if note and note.hash == entry[3]:
+                    continue
+                content_hash = entry[3]
+            else:
+                with self.store.open(filename) as f:
+                    data = list(iter(functools.partial(f.read, chunk_size),
+                        b''))
+                content_hash = self.__hash(content=b''.join(data))
+            if note:
+                if note.hash != content_hash:
+                    changed.add(filename)
+                note.hash = content_hash
+                note.mtime = stat.st_mtime
+                i = self.list.index(note)
+                self.__emit(self.TOUCHED, note, old=i, new=i)
+            else:
+                if names is None:
+                    try:
+                        names = read_data_file(data_file)
+                    except (OSError, ValueError):
+                        names = {}
+                (name, tags) = names.get(filename, (None, frozenset()))
+                unique = name
+                while not unique or unique in self.names:
+                    unique = (name or 'unnamed_note') + '_' + uuid.uuid4().hex
+                note = Note(filename, unique, stat.st_mtime, content_hash)
+                self.__insert(note)
+                if tags:
+                    self.__tag(note, tags)
+            if data is not None:
+                self.worker.submit(('revision', filename),
+                        functools.partial(self.__add_revision, filename, data,
+                            stat.st_mtime_ns))
+                self.index.update(filename, note.name, stat.st_mtime,
+                        stat.st_size, content_hash)
+                self.worker.submit(('search', filename),
+                        functools.partial(self.__index_note, filename,
+                            content_hash, data))
+        for (filename, (name, tags)) in (names or {}).items():
+            note = self.files.get(filename)
+            if not note:
+                continue
+            if name and name != note.name and name not in self.names:
+                self.__rename(note, name)
+            if tags != note.tags:
+                self.__tag(note, tags)
+        self.__commit_index()
+        return changed
+
+    def search(self, query, limit=None):
+        results = self.search_index.search(query, limit)
+        return [self.files[filename] for filename in results
+                if filename in self.files]
+
+    def __stat_all(self, entries):
+        stats = []
+        for filename in entries:
+            try:
+                stat = os.stat(os.path.join(notes_dir, filename))
+            except OSError:
+                continue
+            stats.append((filename, stat.st_mtime, stat.st_size))
+        return stats
+
+    # Wait for the pending writes and mark the index as up to date again.
+    def write(self):
+        with timed('Notes.write'):
+            self.__write_names()
+            self.worker.flush()
+            self.index.set_meta('data-mtime', os.stat(data_file).st_mtime)
+            # The notes directory has been changed by ourselves only if it
+            # still contains exactly the notes we know.
+            dir_mtime = os.stat(notes_dir).st_mtime
+            if (isinstance(self.store, FileStore)
+                    and set(os.listdir(notes_dir)) == self.files.keys()):
+                self.index.set_meta('dir-mtime', dir_mtime)
+            self.index.commit()
+
+    def __name_changed(self, note, removed=False):
+        with self.names_lock:
+            self.names_changes[note.filename] = None if removed \
+                    else (note.name, note.tags)
+
+    # The data file is rewritten in the background after every change of the
+    # names or tags, so that a crash does not lose them. Another instance
+    # (e.g. the command line) might have changed it in the meantime, so only
+    # the notes we have changed since the last time are replaced in it, under
+    # the lock. Changes made in quick succession are written at once.
+    def __write_names(self):
+        if self.batched is not None:
+            self.batched.add('names')
+            return
+
+        def write():
+            with self.names_lock:
+                (changes, self.names_changes) = (self.names_changes, {})
+            try:
+                with locked(lock_file):
+                    try:
+                        before = os.stat(data_file)
+                        notes = read_data_file(data_file)
+                    except (OSError, ValueError):
+                        (before, notes) = (None, {})
+                    if before and not changes:
+                        return
+                    for (filename, entry) in changes.items():
+                        if entry is None:
+                            notes.pop(filename, None)
+                        else:
+                            notes[filename] = entry
+                    data = format_key_file({
+                        'NotesNames': {filename: name
+                            for (filename, (name, tags)) in notes.items()},
+                        'NotesTags': {filename: format_tags(tags)
+                            for (filename, (name, tags)) in notes.items()
+                            if tags},
+                        })
+                    write_atomic(data_file, data.encode())
+                    stat = os.stat(data_file)
+            except:
+                # keep the changes for the next write
+                with self.names_lock:
+                    changes.update(self.names_changes)
+                    self.names_changes = changes
+                raise
+            # the changes of the others are picked up by refresh
+            if before and (before.st_mtime_ns, before.st_size) \
+                    != self.names_stat:
+                self.names_stat = None
+            else:
+                self.names_stat = (stat.st_mtime_ns, stat.st_size)
+
+        self.worker.submit(data_file, write)
+
+
+# The notes are stored in the notes directory, one file per note, unless
+# they have been migrated into the database (see DatabaseStore). Both stores
+# may be used from any thread.
+class FileStore:
+    def close(self):
+        pass
+
+    def open(self, filename):
+        return open(self.path(filename), 'rb')
+
+    def path(self, filename):
+        return os.path.join(notes_dir, filename)
+
+    # the note might have been deleted before it has been written
+    def remove(self, filename):
+        path = self.path(filename)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def stat(self, filename):
+        stat = os.stat(self.path(filename))
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def write(self, filename, data, content_hash, mtime_ns):
+        write_atomic(self.path(filename), data, mtime_ns)
+
+
+# All notes in a single SQLite database instead of thousands of small files.
+# The contents are compressed and stored by their hash, so notes with the
+# same content share it. A content is removed together with its last note.
+class DatabaseStore:
+    COMPRESSION_LEVEL = 6
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS contents ('
+                'hash TEXT PRIMARY KEY, data BLOB NOT NULL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS notes ('
+                'filename TEXT PRIMARY KEY, hash TEXT NOT NULL, '
+                'mtime INTEGER NOT NULL, size INTEGER NOT NULL)')
+        self.db.execute(
+                'CREATE INDEX IF NOT EXISTS notes_hash ON notes (hash)')
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    # Returns the modification time (in nanoseconds), the size and the hash
+    # of every note by its file name.
+    def entries(self):
+        with self.lock:
+            rows = self.db.execute(
+                    'SELECT filename, mtime, size, hash FROM notes')
+            return {row[0]: row[1:] for row in rows}
+
+    def open(self, filename):
+        with self.lock:
+            row = self.db.execute('SELECT data FROM contents JOIN notes '
+                    'USING (hash) WHERE filename = ?', (filename,)).fetchone()
+        if not row:
+            raise FileNotFoundError('no such note: %s' % filename)
+        return io.BytesIO(zlib.decompress(row[0]))
+
+    def path(self, filename):
+        return None
+
+    def remove(self, filename):
+        with self.lock:
+            row = self.db.execute('SELECT hash FROM notes WHERE filename = ?',
+                    (filename,)).fetchone()
+            self.db.execute('DELETE FROM notes WHERE filename = ?',
+                    (filename,))
+            if row:
+                self.__remove_unused(row[0])
+            self.db.commit()
+
+    def __remove_unused(self, content_hash):
+        self.db.execute('DELETE FROM contents WHERE hash = ? AND NOT EXISTS '
+                '(SELECT 1 FROM notes WHERE hash = ?)',
+                (content_hash, content_hash))
+
+    def stat(self, filename):
+        with self.lock:
+            row = self.db.execute(
+                    'SELECT mtime, size FROM notes WHERE filename = ?',
+                    (filename,)).fetchone()
+        if not row:
+            raise FileNotFoundError('no such note: %s' % filename)
+        return row
+
+    # The content is only compressed if it is not stored already.
+    def write(self, filename, data, content_hash, mtime_ns):
+        with self.lock:
+            row = self.db.execute('SELECT hash FROM notes WHERE filename = ?',
+                    (filename,)).fetchone()
+            exists = self.db.execute('SELECT 1 FROM contents WHERE hash = ?',
+                    (content_hash,)).fetchone()
+            if not exists:
+                compressor = zlib.compressobj(self.COMPRESSION_LEVEL)
+                compressed = [compressor.compress(chunk) for chunk in data]
+                compressed.append(compressor.flush())
+                self.db.execute('INSERT INTO contents VALUES (?, ?)',
+                        (content_hash, b''.join(compressed)))
+            self.db.execute('INSERT OR REPLACE INTO notes VALUES (?, ?, ?, ?)',
+                    (filename, content_hash, mtime_ns,
+                        sum(len(chunk) for chunk in data)))
+            if row and row[0] != content_hash:
+                self.__remove_unused(row[0])
+            self.db.commit()
+
+
+# Runs jobs in a background thread, one after the other. A job replaces the
+# pending job with the same key, so that e.g. a note which is saved several
+# times in a row is written only once.
+class Worker:
+    def __init__(self):
+        self.jobs = {}
+        self.running = None
+        self.condition = threading.Condition()
+        thread = threading.Thread(target=self.__run, daemon=True)
+        thread.start()
+
+    def flush(self):
+        with self.condition:
+            while self.jobs or self.running is not None:
+                self.condition.wait()
+
+    def __run(self):
+        while True:
+            with self.condition:
+                while not self.jobs:
+                    self.condition.wait()
+                self.running = next(iter(self.jobs))
+                job = self.jobs.pop(self.running)
+            try:
+                with timed('worker job'):
+                    job()
+            except Exception as err:
+                sys.stderr.write('%s: %s\n' % (sys.argv[0], err))
+            with self.condition:
+                self.running = None
+                self.condition.notify_all()
+
+    # Whether a job with the given key is waiting or running.
+    def pending(self, key):
+        with self.condition:
+            return key in self.jobs or self.running == key
+
+    def submit(self, key, job):
+        with self.condition:
+            self.jobs[key] = job
+            self.condition.notify_all()
+
+
+# The journal records the unsaved edits of the open note, so that they can be
+# restored after a crash. It starts with the name and the content hash of the
+# saved note, followed by one line per edit. The lines are appended in the
+# background, so that an edit only costs as much as its own size.
+# A journal left behind by a crashed session is read before it is replaced.
+class Journal:
+    def __init__(self, path, worker):
+        self.path = path
+        try:
+            self.recovered = read_journal(path)
+        except (OSError, ValueError):
+            self.recovered = None
+        self.active = False
+        self.lock = threading.Lock()
+        self.pending = []
+        self.truncate = False
+        self.worker = worker
+
+    # Remove the journal, as all changes have been saved or discarded.
+    def close(self):
+        self.stop()
+        self.worker.flush()
+
+    def __flush(self):
+        with self.lock:
+            (lines, self.pending) = (self.pending, [])
+            mode = 'w' if self.truncate else 'a'
+            self.truncate = False
+        with open(self.path, mode) as f:
+            f.writelines(lines)
+
+    def record(self, action, start, end, text):
+        if not self.active:
+            return
+        with self.lock:
+            self.pending.append(json.dumps([action, start, end, text]) + '\n')
+        self.worker.submit(self.path, self.__flush)
+
+    def __remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    # Start a new journal for a note whose saved content has the hash
+    # "content_hash". The file is only written once there is an edit to
+    # record.
+    def start(self, name, content_hash):
+        header = {'name': name, 'hash': content_hash}
+        with self.lock:
+            self.pending = [json.dumps(header) + '\n']
+            self.truncate = True
+        self.active = True
+        self.worker.submit(self.path, self.__remove)
+
+    def stop(self):
+        with self.lock:
+            self.pending = []
+        self.active = False
+        self.worker.submit(self.path, self.__remove)
+
+
+# Imports notes read from an archive (see archive_read), unless a note with
+# the same content exists already. A note whose name has been taken gets a
+# number appended.
+class Importer:
+    def __init__(self, notes):
+        self.notes = notes
+        self.hashes = {note.hash for note in notes.list}
+        self.imported = 0
+        self.skipped = 0
+
+    def add(self, name, mtime_ns, data, content_hash, tags=frozenset()):
+        if content_hash in self.hashes:
+            self.skipped += 1
+            return False
+        name = name or 'unnamed_note'
+        unique = name
+        i = 1
+        while unique in self.notes.names:
+            i += 1
+            unique = '%s (%d)' % (name, i)
+        self.notes.note_write(unique, data, mtime_ns)
+        # tags written by other programs might not be valid here
+        try:
+            self.notes.note_tag(unique, tags)
+        except ValueError:
+            pass
+        self.hashes.add(content_hash)
+        self.imported += 1
+        return True
+
+
+# An ordered collection of notes, sorted by their cached keys. A note which is
+# added, removed or renamed is placed by bisection, so that the list never
+# needs to be sorted again. The "keys" list mirrors the keys of the notes,
+# since bisect cannot compare the notes themselves.
+class SortedNotes:
+    def __init__(self, notes=()):
+        self.notes = sorted(notes, key=lambda note: note.key)
+        self.keys = [note.key for note in self.notes]
+
+    def __getitem__(self, i):
+        return self.notes[i]
+
+    def __iter__(self):
+        return iter(self.notes)
+
+    def __len__(self):
+        return len(self.notes)
+
+    def add(self, note):
+        i = bisect.bisect_right(self.keys, note.key)
+        self.keys.insert(i, note.key)
+        self.notes.insert(i, note)
+        return i
+
+    def index(self, note):
+        return bisect.bisect_left(self.keys, note.key)
+
+    def remove(self, note):
+        i = self.index(note)
+        del self.keys[i]
+        del self.notes[i]
+        return i
+
+    # Returns the old and the new position of the renamed note.
+    def rename(self, note, name):
+        i = self.index(note)
+        note.rename(name)
+        j = bisect.bisect_right(self.keys, note.key)
+        if j > i:
+            j -= 1
+        if j != i:
+            del self.keys[i]
+            self.keys.insert(j, note.key)
+            self.notes.insert(j, self.notes.pop(i))
+        else:
+            self.keys[i] = note.key
+        return (i, j)
+
+
+# The notes ordered by their modification times, the newest (or the oldest)
+# first, for the time column of the overview. Like SortedNotes, it returns the
+# positions of a changed note, so that the view can be updated row by row.
+class TimeSortedNotes:
+    def __init__(self, notes, newest_first=True):
+        self.sign = -1 if newest_first else 1
+        self.notes = sorted(notes, key=operator.attrgetter('mtime'),
+                reverse=newest_first)
+        self.keys = [self.sign * note.mtime for note in self.notes]
+        # the key of every note when it has been sorted in, as its
+        # modification time has already been changed when it is updated
+        self.note_keys = {note.filename: key
+                for (note, key) in zip(self.notes, self.keys)}
+
+    def __getitem__(self, i):
+        return self.notes[i]
+
+    def __iter__(self):
+        return iter(self.notes)
+
+    def __len__(self):
+        return len(self.notes)
+
+    def __add(self, note):
+        key = self.sign * note.mtime
+        i = bisect.bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.notes.insert(i, note)
+        self.note_keys[note.filename] = key
+        return i
+
+    # Several notes might have the same modification time.
+    def __remove(self, note):
+        i = bisect.bisect_left(self.keys, self.note_keys.pop(note.filename))
+        while self.notes[i] is not note:
+            i += 1
+        del self.keys[i]
+        del self.notes[i]
+        return i
+
+    # Takes an event of Notes (see there) and returns the old and the new
+    # position of the note.
+    def update(self, event, note):
+        (old, new) = (None, None)
+        if event != Notes.INSERTED:
+            old = self.__remove(note)
+        if event != Notes.REMOVED:
+            new = self.__add(note)
+        return (old, new)
+
+
+# A trigram index over the names of the notes for the fuzzy filter. A name
+# matches if it contains enough of the trigrams of the filter text.
+class TitleIndex:
+    # minimum share of the trigrams of the filter text
+    SIMILARITY = 0.6
+
+    def __init__(self, notes=()):
+        self.trigrams = collections.defaultdict(set)
+        for note in notes:
+            self.add(note)
+
+    def add(self, note):
+        for trigram in trigrams(note.name):
+            self.trigrams[trigram].add(note)
+
+    def remove(self, note):
+        for trigram in trigrams(note.name):
+            postings = self.trigrams[trigram]
+            postings.discard(note)
+            if not postings:
+                del self.trigrams[trigram]
+
+    def search(self, text):
+        postings = sorted((self.trigrams.get(trigram, set())
+            for trigram in trigrams(text, prefix=True)), key=len)
+        if not postings:
+            return set()
+        needed = math.ceil(len(postings) * self.SIMILARITY)
+        # a note with enough trigrams has to be in one of the shortest lists,
+        # so only these notes are looked up in the longer ones
+        shortest = len(postings) - needed + 1
+        hits = collections.Counter()
+        for notes in postings[:shortest]:
+            hits.update(notes)
+        for notes in postings[shortest:]:
+            hits.update([note for note in hits if note in notes])
+        return {note for (note, count) in hits.items() if count >= needed}
+
+
+# The index caches the file names, note names, modification times, sizes and
+# content hashes of all notes, so that a warm start only needs to look at the
+# notes which have actually changed.
+class NotesIndex:
+    def __init__(self, path):
+        # the index is committed by the worker thread of Notes
+        self.lock = threading.Lock()
+        self.db = open_cache(path, [
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)',
+            'CREATE TABLE IF NOT EXISTS notes ('
+                'filename TEXT PRIMARY KEY, name TEXT, mtime REAL, '
+                'size INTEGER, hash TEXT)',
+            'CREATE TABLE IF NOT EXISTS tags ('
+                'filename TEXT, tag TEXT, PRIMARY KEY (filename, tag))',
+            ])
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def entries(self):
+        with self.lock:
+            rows = self.db.execute(
+                    'SELECT filename, name, mtime, size, hash FROM notes')
+            return {row[0]: list(row[1:]) for row in rows}
+
+    def get(self, filename):
+        with self.lock:
+            row = self.db.execute('SELECT name, mtime, size, hash FROM notes '
+                    'WHERE filename = ?', (filename,)).fetchone()
+            return list(row) if row else None
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                    (key,)).fetchone()
+            return row[0] if row else None
+
+    def remove(self, filename):
+        with self.lock:
+            self.db.execute('DELETE FROM notes WHERE filename = ?',
+                    (filename,))
+            self.db.execute('DELETE FROM tags WHERE filename = ?',
+                    (filename,))
+
+    def rename(self, filename, name):
+        with self.lock:
+            self.db.execute('UPDATE notes SET name = ? WHERE filename = ?',
+                    (name, filename))
+
+    def replace_tags(self, tags):
+        with self.lock:
+            self.db.execute('DELETE FROM tags')
+            self.db.executemany('INSERT INTO tags VALUES (?, ?)',
+                    ((filename, tag) for (filename, note_tags) in tags.items()
+                        for tag in note_tags))
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                    (key, value))
+
+    def set_tags(self, filename, tags):
+        with self.lock:
+            self.db.execute('DELETE FROM tags WHERE filename = ?',
+                    (filename,))
+            self.db.executemany('INSERT INTO tags VALUES (?, ?)',
+                    ((filename, tag) for tag in tags))
+
+    # Returns the tags of every note which has any.
+    def tags(self):
+        with self.lock:
+            tags = {}
+            rows = self.db.execute('SELECT filename, tag FROM tags')
+            for (filename, tag) in rows:
+                tags.setdefault(filename, set()).add(tag)
+            return {filename: frozenset(note_tags)
+                    for (filename, note_tags) in tags.items()}
+
+    def update(self, filename, name, mtime, size, content_hash):
+        with self.lock:
+            self.db.execute(
+                    'INSERT OR REPLACE INTO notes VALUES (?, ?, ?, ?, ?)',
+                    (filename, name, mtime, size, content_hash))
+
+
+# An inverted index which maps every word to the notes containing it (and how
+# often). The content hash of every indexed note is stored as well, so that
+# notes changed outside of rnote can be found without reading them.
+class SearchIndex:
+    # A shorter last word of a query only matches itself, as it would be the
+    # prefix of too many words. A longer one matches the most frequent words
+    # it is the prefix of.
+    MIN_PREFIX = 3
+    MAX_PREFIX_WORDS = 32
+
+    def __init__(self, path):
+        # the index is updated by the worker thread of Notes
+        self.lock = threading.RLock()
+        self.db = open_cache(path, [
+            'CREATE TABLE IF NOT EXISTS documents ('
+                'filename TEXT PRIMARY KEY, hash TEXT)',
+            'CREATE TABLE IF NOT EXISTS postings ('
+                'token TEXT, filename TEXT, count INTEGER, '
+                'PRIMARY KEY (token, filename)) WITHOUT ROWID',
+            'CREATE INDEX IF NOT EXISTS postings_filename '
+                'ON postings (filename)',
+            ])
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def hashes(self):
+        with self.lock:
+            return dict(self.db.execute(
+                'SELECT filename, hash FROM documents'))
+
+    def remove(self, filename):
+        with self.lock:
+            self.db.execute('DELETE FROM documents WHERE filename = ?',
+                    (filename,))
+            self.db.execute('DELETE FROM postings WHERE filename = ?',
+                    (filename,))
+
+    # Return the file names of the notes containing all the words of the
+    # query, ranked by tf-idf, the best "limit" ones if given. The last word
+    # of the query is treated as a prefix, since the user might still be
+    # typing it. The scores are summed up by SQLite, so only the results
+    # themselves are fetched.
+    def search(self, query, limit=None):
+        with self.lock:
+            return self.__search(query, limit)
+
+    def __search(self, query, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        (count,) = self.db.execute(
+                'SELECT COUNT(*) FROM documents').fetchone()
+        # (word, number of the word of the query, idf) of every word looked
+        # for
+        weights = []
+        for (i, token) in enumerate(tokens):
+            if i == len(tokens)-1 and len(token) >= self.MIN_PREFIX:
+                rows = self.db.execute('SELECT token, COUNT(*) AS n '
+                        'FROM postings WHERE token >= ? AND token < ? '
+                        'GROUP BY token ORDER BY n DESC LIMIT ?',
+                        (token, token + '\U0010ffff', self.MAX_PREFIX_WORDS))
+            else:
+                rows = self.db.execute('SELECT token, COUNT(*) '
+                        'FROM postings WHERE token = ? GROUP BY token',
+                        (token,))
+            rows = rows.fetchall()
+            if not rows:
+                return []
+            weights += [(word, i, math.log(1 + count / frequency))
+                    for (word, frequency) in rows]
+        rows = self.db.execute('WITH weights (token, term, weight) AS '
+                '(VALUES %s) SELECT filename FROM weights '
+                'JOIN postings USING (token) GROUP BY filename '
+                'HAVING COUNT(DISTINCT term) = ? '
+                'ORDER BY SUM(postings.count * weight) DESC, filename '
+                'LIMIT ?' % ', '.join(['(?, ?, ?)'] * len(weights)),
+                [value for weight in weights for value in weight]
+                + [len(tokens), -1 if limit is None else limit])
+        return [filename for (filename,) in rows]
+
+    # "postings" maps the words of the note to their number of occurrences
+    # (see count_tokens).
+    def update(self, filename, content_hash, postings):
+        with self.lock:
+            self.remove(filename)
+            self.db.execute('INSERT INTO documents VALUES (?, ?)',
+                    (filename, content_hash))
+            self.db.executemany('INSERT INTO postings VALUES (?, ?, ?)',
+                    ((token, filename, count)
+                        for (token, count) in postings.items()))
+
+
+# Opt-in instrumentation (see --timings): the durations of some operations
+# are written to a rotating log. When rnote quits, a summary with their
+# percentiles is added.
+class Timings:
+    LOG_SIZE = 1 << 20
+    LOG_BACKUPS = 3
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, path):
+        self.durations = collections.defaultdict(list)
+        self.lock = threading.Lock()
+        self.handler = logging.handlers.RotatingFileHandler(path,
+                maxBytes=self.LOG_SIZE, backupCount=self.LOG_BACKUPS,
+                encoding='utf-8')
+        self.handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        self.logger = logging.getLogger(app_name + '.timings')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    # Durations which are not logged still show up in the summary.
+    def add(self, name, duration, log=True):
+        with self.lock:
+            self.durations[name].append(duration)
+        if log:
+            self.logger.info('%s %.3f ms', name, duration * 1000)
+
+    def close(self):
+        for line in self.summary():
+            self.logger.info('summary %s', line)
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+    def summary(self):
+        lines = []
+        with self.lock:
+            for (name, durations) in sorted(self.durations.items()):
+                durations = sorted(durations)
+                values = ['n=%d' % len(durations)]
+                for p in self.PERCENTILES:
+                    i = max(math.ceil(p / 100 * len(durations)) - 1, 0)
+                    values.append('p%d=%.3f' % (p, durations[i] * 1000))
+                values.append('max=%.3f' % (durations[-1] * 1000))
+                lines.append('%s: %s ms' % (name, ' '.join(values)))
+        return lines
+
+
+# Only one graphical interface runs at a time: a second start hands over to
+# the running one through a local socket, which then raises its window, and
+# quits before GTK has even been loaded.
+class Instance:
+    def __init__(self, path):
+        self.path = path
+        # the listening socket of the running instance
+        self.sock = None
+
+    # Returns the messages sent by another start (see handoff).
+    def accept(self):
+        try:
+            (conn, address) = self.sock.accept()
+        except OSError:
+            return []
+        with conn:
+            conn.settimeout(1)
+            data = b''
+            try:
+                while True:
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        break
+                    data += chunk
+            except OSError:
+                return []
+        return data.decode(errors='replace').split()
+
+    def close(self):
+        if not self.sock:
+            return
+        self.sock.close()
+        self.sock = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    # Returns True if the message has been handed to a running instance.
+    # Otherwise, this one becomes the running instance. The lock makes sure
+    # that two simultaneous starts do not both take over.
+    def handoff(self, message='activate'):
+        with locked(lock_file):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                sock.sendall(message.encode())
+                return True
+            except OSError:
+                pass
+            finally:
+                sock.close()
+            # left behind by an instance which has crashed
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.bind(self.path)
+            self.sock.listen()
+            self.sock.setblocking(False)
+        return False
+
+    # Whether another instance is running. The caller holds the lock.
+    def running(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            return True
+        except OSError:
+            return False
+        finally:
+            sock.close()
+
+
+# Read the notes of an archive one by one. Any tar archive can be read; the
+# members which have not been written by rnote are named like their files.
+# Yields the name, the modification time, the content (as a list of chunks),
+# its hash and the tags of every note, together with the number of bytes of
+# the archive read so far and its size.
+def archive_read(path):
+    with open(path, 'rb') as f, \
+            tarfile.open(fileobj=f, mode='r|*') as archive:
+        size = os.fstat(f.fileno()).st_size
+        for info in archive:
+            if not info.isfile():
+                continue
+            name = info.pax_headers.get(archive_name_header,
+                    os.path.basename(info.name))
+            member = archive.extractfile(info)
+            data = []
+            digest = hashlib.sha1()
+            for chunk in iter(functools.partial(member.read, chunk_size), b''):
+                data.append(chunk)
+                digest.update(chunk)
+            tags = parse_tags(info.pax_headers.get(archive_tags_header, ''))
+            yield (name, int(info.mtime * 10**9), data, digest.hexdigest(),
+                    tags, f.tell(), size)
+
+
+# Write the notes (a list, which must not be changed while it is written)
+# from the store (see FileStore) into a compressed tar archive as a stream,
+# one after the other. The name and the tags of a note are stored in PAX
+# headers of its member. Yields the number of notes written so far and their
+# total number. Notes which have been deleted in the meantime are skipped.
+def archive_write(path, notes, store):
+    with tarfile.open(path, 'w|gz', format=tarfile.PAX_FORMAT) as archive:
+        for (i, note) in enumerate(notes):
+            try:
+                mtime_ns = store.stat(note.filename)[0]
+                f = store.open(note.filename)
+            except FileNotFoundError:
+                continue
+            with f:
+                info = tarfile.TarInfo(note.filename)
+                # the note might have been replaced in the meantime
+                info.size = f.seek(0, io.SEEK_END)
+                f.seek(0)
+                info.mtime = mtime_from_ns(mtime_ns)
+                info.mode = 0o600
+                info.pax_headers = {archive_name_header: note.name}
+                if note.tags:
+                    info.pax_headers[archive_tags_header] = \
+                            format_tags(note.tags)
+                archive.addfile(info, f)
+            yield (i + 1, len(notes))
+
+
+# A delta consists of instructions to copy a range of the old version
+# ("C", offset and length) or to insert new bytes ("I", length and bytes).
+# The common beginning and end of both versions are found first, so that a
+# local change costs little even in a huge note. Only the lines in between
+# are compared by difflib.
+def delta_create(old, new):
+    prefix = common_prefix(old, new)
+    limit = min(len(old), len(new)) - prefix
+    suffix = common_prefix(old[::-1][:limit], new[::-1][:limit])
+    old_lines = old[prefix:len(old) - suffix].splitlines(keepends=True)
+    new_lines = new[prefix:len(new) - suffix].splitlines(keepends=True)
+    old_offsets = [prefix]
+    for line in old_lines:
+        old_offsets.append(old_offsets[-1] + len(line))
+    ops = []
+    if prefix:
+        ops.append(delta_copy(0, prefix))
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+    for (tag, i1, i2, j1, j2) in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(delta_copy(old_offsets[i1],
+                old_offsets[i2] - old_offsets[i1]))
+        elif j1 < j2:
+            data = b''.join(new_lines[j1:j2])
+            ops.append(b'I' + struct.pack('=Q', len(data)) + data)
+    if suffix:
+        ops.append(delta_copy(len(old) - suffix, suffix))
+    return b''.join(ops)
+
+
+def delta_apply(old, delta):
+    parts = []
+    pos = 0
+    while pos < len(delta):
+        op = delta[pos:pos + 1]
+        pos += 1
+        if op == b'C':
+            (offset, length) = struct.unpack_from('=QQ', delta, pos)
+            pos += 16
+            parts.append(old[offset:offset + length])
+        elif op == b'I':
+            (length,) = struct.unpack_from('=Q', delta, pos)
+            pos += 8
+            parts.append(delta[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError('invalid delta')
+    return b''.join(parts)
+
+
+def delta_copy(offset, length):
+    return b'C' + struct.pack('=QQ', offset, length)
+
+
+def die(error):
+    sys.exit('%s: %s' % (sys.argv[0], error))
+
+
+# The data file is a key file as written by GLib.KeyFile. Only what rnote
+# itself writes is supported: groups of keys with string values.
+def format_key_file(groups):
+    lines = []
+    for (group, entries) in groups.items():
+        if lines:
+            lines.append('')
+        lines.append('[%s]' % group)
+        for (key, value) in entries.items():
+            lines.append('%s=%s' % (key, key_file_escape(value)))
+    return '\n'.join(lines) + '\n'
+
+
+# The tags are separated by semicolons in the data file, like the values of a
+# list in a GLib key file, and by commas in the interface.
+def format_tags(tags, separator=';'):
+    return separator.join(sorted(tags))
+
+
+# Only whole minutes are shown, so the formatted times are cached per minute
+# (and per day, which the relative dates depend on).
+@functools.lru_cache(maxsize=4096)
+def format_minute(minute, today):
+    mtime = time.localtime(minute * 60)
+    days = today - datetime.date(*mtime[:3]).toordinal()
+    if days == 0:
+        return time.strftime('today %H:%M', mtime)
+    elif days == 1:
+        return time.strftime('yesterday %H:%M', mtime)
+    return time.strftime('%x %H:%M', mtime)
+
+
+# Format a modification time for the overview. This is only done for the rows
+# which are actually shown.
+def format_time(mtime):
+    return format_minute(int(mtime // 60), datetime.date.today().toordinal())
+
+
+def key_file_escape(value):
+    value = value.replace('\\', '\\\\').replace('\n', '\\n')
+    value = value.replace('\t', '\\t').replace('\r', '\\r')
+    # leading whitespace would get lost otherwise
+    if value.startswith(' '):
+        value = '\\s' + value[1:]
+    return value
+
+
+def key_file_unescape(value):
+    return re.sub(r'\\(.)', lambda match: key_file_escapes.get(
+        match.group(1), match.group(0)), value)
+
+
+# The caches can be rebuilt from the notes at any time, so a broken one is
+# simply deleted.
+def open_cache(path, schema):
+    def connect():
+        # SearchIndex guards its connection with a lock of its own
+        db = sqlite3.connect(path, check_same_thread=False)
+        # A cache does not need to survive a power failure, only to stay
+        # consistent, so a commit does not have to wait for the disk.
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        for statement in schema:
+            db.execute(statement)
+        return db
+
+    try:
+        return connect()
+    except sqlite3.Error:
+        os.remove(path)
+        return connect()
+
+
+def parse_tags(text, separator=';'):
+    return frozenset(tag.strip() for tag in text.split(separator)
+            if tag.strip())
+
+
+# Returns the name and the tags of every note in the data file. Raises
+# ValueError if the file is not a key file.
+def read_data_file(path):
+    groups = read_key_file(path)
+    tags = groups.get('NotesTags', {})
+    return {filename: (name, parse_tags(tags.get(filename, '')))
+            for (filename, name) in groups.get('NotesNames', {}).items()}
+
+
+# Raises ValueError if the file is not a key file.
+def read_key_file(path):
+    groups = {}
+    entries = None
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            if line.startswith('['):
+                entries = groups.setdefault(line[1:line.index(']')], {})
+            elif entries is not None and '=' in line:
+                (key, value) = line.split('=', 1)
+                entries[key.strip()] = key_file_unescape(value.lstrip())
+            else:
+                raise ValueError('invalid line in %s: %s' % (path, line))
+    return groups
+
+
+# Hold the advisory lock on the file for the duration of the block. It is
+# used by all the instances of rnote sharing the application directory.
+@contextlib.contextmanager
+def locked(path):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+# This is how os.stat calculates st_mtime from st_mtime_ns.
+def mtime_from_ns(mtime_ns):
+    return mtime_ns // 10**9 + mtime_ns % 10**9 * 1e-9
+
+
+# Add the time spent since "start" to the startup profile. The steps of the
+# startup are instrumented as well (see Timings).
+def profile_add(name, start):
+    duration = time.perf_counter() - start
+    if profile is not None:
+        profile.append((name, duration))
+    if timings is not None:
+        timings.add(name, duration)
+
+
+def profile_report():
+    for (name, duration) in profile:
+        sys.stderr.write('%-16s %8.1f ms\n' % (name, duration * 1000))
+
+
+# Return the header and the edits of a journal (see Journal). A crash might
+# have left an incomplete last line behind, which is ignored.
+def read_journal(path):
+    edits = []
+    with open(path, 'r') as f:
+        header = json.loads(f.readline())
+        for line in f:
+            try:
+                edits.append(json.loads(line))
+            except ValueError:
+                break
+    return (header, edits)
+
+
+def setup():
+    global app_dir, config_file, data_file, history_dir, index_file, \
+            journal_file, lines_dir, lock_file, notes_dir, revisions_dir, \
+            search_file, socket_file, store_file, timings_file
+
+    def check_dir(dirname):
+        if os.path.isdir(dirname):
+            return
+        try:
+            os.mkdir(dirname, 448)
+        except:
+            die('Cannot create %s' % dirname)
+
+    try:
+        home_dir = os.environ['HOME']
+    except:
+        die('Could not get the name of your home directory')
+
+    app_dir = os.path.join(home_dir, app_dir)
+    config_file = os.path.join(app_dir, config_file)
+    data_file = os.path.join(app_dir, data_file)
+    history_dir = os.path.join(app_dir, history_dir)
+    index_file = os.path.join(app_dir, index_file)
+    journal_file = os.path.join(app_dir, journal_file)
+    lines_dir = os.path.join(app_dir, lines_dir)
+    lock_file = os.path.join(app_dir, lock_file)
+    revisions_dir = os.path.join(app_dir, revisions_dir)
+    search_file = os.path.join(app_dir, search_file)
+    socket_file = os.path.join(app_dir, socket_file)
+    store_file = os.path.join(app_dir, store_file)
+    timings_file = os.path.join(app_dir, timings_file)
+    notes_dir = os.path.join(app_dir, notes_dir)
+    check_dir(app_dir)
+    check_dir(history_dir)
+    check_dir(lines_dir)
+    check_dir(revisions_dir)
+    check_dir(notes_dir)
+
+
+# Returns the tags as a frozenset. Raises ValueError if a tag contains one of
+# the separators (see format_tags).
+def check_tags(tags):
+    tags = frozenset(tag.strip() for tag in tags if tag.strip())
+    for tag in tags:
+        if ';' in tag or ',' in tag:
+            raise ValueError('invalid tag: %s' % tag)
+    return tags
+
+
+# Returns the length of the common beginning of two byte strings. Blocks are
+# compared first, so that long equal parts are skipped quickly.
+def common_prefix(a, b, block=65536):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i:i + block] == b[i:i + block]:
+        i += block
+    while i < n and a[i] == b[i]:
+        i += 1
+    return min(i, n)
+
+
+# Count the words of a text given in pieces. A word might be split between
+# two pieces, so the word at the end of a piece is kept for the next one.
+def count_tokens(chunks):
+    counts = collections.Counter()
+    rest = ''
+    for chunk in chunks:
+        text = rest + chunk
+        i = len(text)
+        while i and (text[i-1].isalnum() or text[i-1] == '_'):
+            i -= 1
+        counts.update(tokenize(text[:i]))
+        rest = text[i:]
+    counts.update(tokenize(rest))
+    return counts
+
+
+# Time the block if the instrumentation is enabled (see Timings).
+@contextlib.contextmanager
+def timed(name):
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+
+# The words are padded, so that their beginnings and endings get trigrams of
+# their own. This way, even one or two letters can be looked up. The end of
+# the last word is left open for text which is still being typed.
+def trigrams(text, prefix=False):
+    result = set()
+    words = text.lower().split()
+    for (n, word) in enumerate(words):
+        if prefix and n == len(words)-1:
+            word = '  ' + word
+        else:
+            word = '  ' + word + ' '
+        result.update(word[i:i+3] for i in range(len(word)-2))
+    return result
+
+
+# Write the data (bytes or a list of bytes) to a temporary file first, so
+# that a crash never leaves a truncated file behind. The temporary files are
+# created in the application directory, so that they do not show up as notes.
+def write_atomic(path, data, mtime_ns=None):
+    if isinstance(data, bytes):
+        data = [data]
+    (fd, tmp) = tempfile.mkstemp(prefix='.tmp_', dir=app_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in data:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if mtime_ns:
+            os.utime(tmp, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+    fd = os.open(os.path.dirname(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,1666 @@
+#!/usr/bin/python3
+
+# rnote - a software to take notes in a simple and convenient way
+# Copyright (C) 2019 Robert Imschweiler
+#
+# This file is part of rnote.
+#
+# rnote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rnote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rnote.  If not, see <https://www.gnu.org/licenses/>.
+
+import codecs
+import hashlib
+import os
+import queue
+import tarfile
+import threading
+import time
+
+import gi
+gi.require_version('Gtk', '3.0')
+gi.require_version('Gdk', '3.0')
+from gi.repository import Gdk, Gio, GLib, GObject, Gtk
+
+import rnote_core as core
+from rnote_core import Edit, Journal, LineIndex, Notes, TimeSortedNotes, \
+        UndoHistory, Worker, app_name, copyright, description, license, \
+        text_hash, version_str
+
+
+# global variables
+app_window = None
+# constants
+help_message = '"'+app_name+'"' + ''' is a software to take notes in a \
+simple and convenient way.
+
+The interface is divided in two parts:
+The upper one contains the overview with the list of your stored notes. \
+The lower one contains a simple editor to create/edit notes.
+You may move the separator between these parts in order to resize them. \
+This setting will be stored - just as the window size.
+
+These buttons are available:
+    delete      delete the currently selected note
+    import      import the notes of an archive, except for those whose \
+content exists already
+    export      write all notes, names included, into an archive
+    search      show only the notes containing all the words you enter, \
+the best matches first (the last word may be incomplete once it has three \
+letters)
+
+    Above the list, you may filter the notes by their names. Small typos are \
+tolerated. Next to it, you may enter tags separated by commas to show only \
+the notes which have all of them (or any of them, if "any" is checked).
+    Click on "Time" to show the latest notes first (or the oldest ones on the \
+next click), and on "Note" to sort them by name again.
+    about       show information about this software
+    quit        quit the program
+
+    save        save the note you are currently working on (a named note is \
+also saved automatically a few seconds after your last change)
+    undo        undo your modifications on the note you are currently working \
+on step by step (even those you have saved before)
+    redo        redo these modifications step by step
+    history     browse the saved versions of the note you are currently \
+working on and restore one of them
+    close       close the note you are currently working on
+
+    You may change the font size of the editor - your selection will be stored.
+
+At any time, you may change the title of the note you are currently working on, \
+it will get renamed.
+Next to the title, you may give the note tags, separated by commas.
+
+Very large notes (16 MiB or more, see "min-size" in the config file) are \
+first shown in a read-only preview, which opens instantly. Use "edit" to load \
+the whole note into the editor.
+
+If rnote has not been closed properly, it offers to restore your unsaved \
+changes at the next start.
+
+Notes changed by other programs are updated in the list at once. If the note \
+you are working on is changed that way, you may choose which version to keep.'''
+
+
+class AppWindow:
+    # enum
+    TEXT_SIZE_MIN = 6
+    TEXT_SIZE_MAX = 72
+    # notes of at least this many bytes are opened in a read-only preview
+    PREVIEW_SIZE = 1 << 24
+
+    def __init__(self, window, pane):
+        # for external use
+        self.window = window
+        self.preview_size = self.PREVIEW_SIZE
+        start = time.perf_counter()
+        try:
+            self.read()
+        except:
+            self.update_size(window, None)
+            self.update_pane(pane, None)
+            self.is_fullscreen = False
+            self.is_maximized = False
+            self.update_text_size(None)
+            return
+        finally:
+            core.profile_add('AppWindow.read', start)
+        pane.set_position(self.pane_position)
+        window.set_default_size(self.width, self.height)
+        if self.is_fullscreen:
+            window.fullscreen()
+        if self.is_maximized:
+            window.maximize()
+
+    def quit(self):
+        self.write()
+        Gtk.main_quit()
+
+    def read(self):
+        gfile = GLib.KeyFile.new()
+        try:
+            gfile.load_from_file(core.config_file, GLib.KeyFileFlags.NONE)
+            self.height = gfile.get_integer('WindowState', 'height')
+            self.width = gfile.get_integer('WindowState', 'width')
+            self.is_maximized = gfile.get_boolean('WindowState', 'is-maximized')
+            self.is_fullscreen = gfile.get_boolean('WindowState', 'is-fullscreen')
+            self.pane_position = gfile.get_integer('WindowState', 'pane-position')
+            self.text_size = gfile.get_integer('WindowState', 'text-size')
+            self.text_size_unit = gfile.get_string('WindowState', 'text-size-unit')
+            # optional, older config files do not contain it
+            try:
+                self.preview_size = gfile.get_uint64('Preview', 'min-size')
+            except:
+                pass
+        except:
+            raise
+        finally:
+            gfile.unref()
+
+    def update_pane(self, paned, scroll_type):
+        self.pane_position = paned.get_position()
+
+    def update_size(self, window, allocation):
+        (self.width, self.height) = window.get_size()
+
+    def update_state(self, window, event):
+        self.is_fullscreen = bool(event.new_window_state & 
+                Gdk.WindowState.FULLSCREEN)
+        self.is_maximized = bool(event.new_window_state & 
+                Gdk.WindowState.MAXIMIZED)
+
+    def update_text_size(self, new_size):
+        if new_size:
+            self.text_size = new_size
+            return
+        try:
+            self.text_size = int(
+                    Gtk.TextView().get_style_context().get_property(
+                        'font-size', Gtk.StateFlags.NORMAL)
+                    )
+        except:
+            self.text_size = 12
+        self.text_size_unit = 'px'
+
+    # Other settings in the config file are kept.
+    def write(self):
+        gfile = GLib.KeyFile.new()
+        with core.locked(core.lock_file):
+            try:
+                gfile.load_from_file(core.config_file,
+                        GLib.KeyFileFlags.KEEP_COMMENTS)
+            except:
+                pass
+            self.__write(gfile)
+        gfile.unref()
+
+    def __write(self, gfile):
+        gfile.set_integer('WindowState', 'height', self.height)
+        gfile.set_integer('WindowState', 'width', self.width)
+        gfile.set_boolean('WindowState', 'is-maximized', self.is_maximized)
+        gfile.set_boolean('WindowState', 'is-fullscreen', self.is_fullscreen)
+        gfile.set_integer('WindowState', 'pane-position', self.pane_position)
+        gfile.set_integer('WindowState', 'text-size', self.text_size)
+        gfile.set_string('WindowState', 'text-size-unit', self.text_size_unit)
+        gfile.set_uint64('Preview', 'min-size', self.preview_size)
+        gfile.save_to_file(core.config_file)
+
+
+class NoteView:
+    # milliseconds after the last change until a note is saved automatically
+    AUTOSAVE_DELAY = 3000
+    # bytes inserted into the text buffer per idle callback while loading
+    LOAD_CHUNK_SIZE = 65536
+    # characters taken from the text buffer at once while saving
+    SAVE_CHUNK_SIZE = 65536
+
+    def __init__(self, save_func, revisions_func):
+        self.autosave_timeout = None
+        self.history_path = None
+        # the file name and the store of the loaded note
+        self.source = None
+        # the file name and the content hash of the note as it has been
+        # loaded or saved the last time (see Overview.files_changed)
+        self.filename = None
+        self.content_hash = None
+        # the tags of the note as they have been loaded or saved
+        self.tags = frozenset()
+        # writes the journal and the undo history in the background
+        self.worker = Worker()
+        self.journal = Journal(core.journal_file, self.worker)
+        self.loading = None
+        self.widget = self.__create()
+        self.save_func = save_func
+        # returns the revision pack of a note (see core.RevisionPack)
+        self.revisions_func = revisions_func
+        self.update()
+
+    def autosave(self):
+        self.autosave_timeout = None
+        if (self.name and self.entry_buffer.get_text() == self.name
+                and self.text_buffer.get_modified()):
+            self.save()
+        return False
+
+    def __cancel_autosave(self):
+        if self.autosave_timeout:
+            GLib.source_remove(self.autosave_timeout)
+            self.autosave_timeout = None
+
+    def __cancel_load(self):
+        if not self.loading:
+            return
+        (cancellable, source) = self.loading
+        cancellable.cancel()
+        if source:
+            GLib.source_remove(source)
+        self.__set_loading(None)
+
+    def check_save_state(self):
+        # a note which is still being loaded or previewed cannot have been
+        # changed yet
+        if self.loading or self.preview.lines:
+            return True
+        if (self.entry_buffer.get_text() == self.name
+                and not self.text_buffer.get_modified()
+                and not self.tags_changed()):
+            return True
+        save = dialog('Save changes before closing?\n'\
+                'Otherwise, your changes to this note will be lost.', 
+                Gtk.ResponseType.YES)
+        if save == 1:
+            return self.save()
+        elif save == 2:
+            return False
+        return True
+
+    def close(self, button=None):
+        close = self.check_save_state()
+        if not close:
+            return False
+        self.update()
+        return True
+
+    def __create_toolbar(self):
+        self.button_edit = Gtk.ToolButton.new(None, 'edit')
+        self.button_edit.connect('clicked', self.edit)
+        self.button_edit.set_no_show_all(True)
+        button_save = Gtk.ToolButton.new(None, 'save')
+        button_save.connect('clicked', self.save)
+        self.button_undo = Gtk.ToolButton.new(None, 'undo')
+        self.button_undo.connect('clicked', self.text_buffer.undo)
+        self.button_redo = Gtk.ToolButton.new(None, 'redo')
+        self.button_redo.connect('clicked', self.text_buffer.redo)
+        button_history = Gtk.ToolButton.new(None, 'history')
+        button_history.connect('clicked', self.show_history)
+        self.entry = Gtk.Entry()
+        self.entry_buffer = self.entry.get_buffer()
+        self.entry.set_placeholder_text('name of this note')
+        entry_container = Gtk.ToolItem.new()
+        entry_container.add(self.entry)
+        entry_container.set_expand(True)
+        self.tags_entry = Gtk.Entry()
+        self.tags_entry.set_placeholder_text('tags, separated by commas')
+        tags_container = Gtk.ToolItem.new()
+        tags_container.add(self.tags_entry)
+        scale = Gtk.SpinButton.new_with_range(app_window.TEXT_SIZE_MIN, 
+                app_window.TEXT_SIZE_MAX, 1)
+        scale.set_value(app_window.text_size)
+        scale.connect('value-changed', self.scale)
+        scale_container = Gtk.ToolItem.new()
+        scale_container.add(scale)
+        scale_container.set_tooltip_text('change font size')
+        button_close = Gtk.ToolButton.new(None, 'close')
+        button_close.connect('clicked', self.close)
+        toolbar = Gtk.Toolbar.new()
+        toolbar.set_style(Gtk.ToolbarStyle.TEXT)
+        toolbar.insert(self.button_edit, -1)
+        toolbar.insert(button_save, -1)
+        toolbar.insert(self.button_undo, -1)
+        toolbar.insert(self.button_redo, -1)
+        toolbar.insert(button_history, -1)
+        toolbar.insert(entry_container, -1)
+        toolbar.insert(tags_container, -1)
+        toolbar.insert(scale_container, -1)
+        toolbar.insert(button_close, -1)
+        return toolbar
+
+    def __create_textview(self):
+        self.text_buffer = UndoRedoTextBuffer()
+        self.text_buffer.connect('undo-redo', self.update_buttons)
+        self.text_buffer.connect('changed', self.__changed)
+        self.text_buffer.connect('modified-changed', self.__modified_changed)
+        self.text_buffer.connect('edit', self.__edit)
+        textview = Gtk.TextView()
+        textview.set_cursor_visible(True)
+        textview.set_editable(True)
+        textview.set_wrap_mode(Gtk.WrapMode.NONE)
+        textview.set_buffer(self.text_buffer)
+        return textview
+
+    def __create(self):
+        self.textview = self.__create_textview()
+        self.preview = Preview()
+        self.scale(None)
+        subwin = Gtk.ScrolledWindow()
+        subwin.add(self.textview)
+        self.stack = Gtk.Stack()
+        self.stack.add_named(subwin, 'editor')
+        self.stack.add_named(self.preview.widget, 'preview')
+        toolbar = self.__create_toolbar()
+        self.progress = Gtk.ProgressBar.new()
+        self.progress.set_no_show_all(True)
+        box = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
+        box.pack_start(toolbar, False, False, 0)
+        box.pack_start(self.progress, False, False, 0)
+        box.pack_start(self.stack, True, True, 0)
+        return box
+
+    # Every change postpones the automatic saving.
+    def __changed(self, text_buffer):
+        if self.loading or not text_buffer.get_modified():
+            return
+        self.__cancel_autosave()
+        self.autosave_timeout = GLib.timeout_add(self.AUTOSAVE_DELAY,
+                self.autosave)
+
+    def __edit(self, text_buffer, action, start, end, text):
+        self.journal.record(action, start, end, text)
+
+    # Leave the preview and load the whole note into the editor.
+    def edit(self, button=None):
+        if self.preview.lines:
+            (filename, store) = self.source
+            self.load(self.name, filename, store, self.tags, preview=False)
+
+    # The content is decoded chunk by chunk as well, so that there never is a
+    # copy of the whole note as a string.
+    def __fill(self, content, offset, decoder):
+        end = offset + self.LOAD_CHUNK_SIZE
+        self.text_buffer.append(decoder.decode(content[offset:end],
+            end >= len(content)))
+        if end < len(content):
+            self.progress.set_fraction(end / len(content))
+            (cancellable, source) = self.loading
+            self.loading = (cancellable,
+                    GLib.idle_add(self.__fill, content, end, decoder))
+            return False
+        self.text_buffer.place_cursor(self.text_buffer.get_start_iter())
+        self.text_buffer.set_modified(False)
+        self.__set_loading(None)
+        core.profile_add('load', self.load_start)
+        content_hash = hashlib.sha1(content).hexdigest()
+        self.content_hash = content_hash
+        self.journal.start(self.name, content_hash)
+        self.text_buffer.set_history(UndoHistory(self.worker,
+            self.history_path, content_hash))
+        return False
+
+    # Return the content of the text buffer piece by piece, so that saving a
+    # huge note does not need to copy it as a whole.
+    def get_chunks(self):
+        start = self.text_buffer.get_start_iter()
+        while not start.is_end():
+            end = start.copy()
+            end.forward_chars(self.SAVE_CHUNK_SIZE)
+            yield self.text_buffer.get_text(start, end, True)
+            start = end
+
+    # Read the note in the background and insert it into the text buffer
+    # chunk by chunk, so that even huge notes do not block the interface.
+    # Loading another note cancels this one. Notes larger than configured are
+    # only previewed. The note is read from the store it is kept in (see
+    # core.FileStore).
+    def load(self, name, filename, store, tags, preview=True):
+        self.update()
+        self.entry_buffer.set_text(name, -1)
+        self.name = name
+        self.set_tags(tags)
+        self.source = (filename, store)
+        self.filename = filename
+        self.history_path = os.path.join(core.history_dir, filename)
+        # until the note is shown completely (see core.Timings)
+        self.load_start = time.perf_counter()
+        cancellable = Gio.Cancellable.new()
+        self.__set_loading((cancellable, None))
+        path = store.path(filename)
+        if not path:
+            self.__load_stored(filename, store, cancellable)
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        if preview and size >= app_window.preview_size:
+            self.__load_preview(path, cancellable)
+            return
+        Gio.File.new_for_path(path).load_contents_async(cancellable,
+                self.__loaded, cancellable)
+
+    def __loaded(self, gfile, result, cancellable):
+        try:
+            (success, content, etag) = gfile.load_contents_finish(result)
+        except GLib.Error as err:
+            if cancellable.is_cancelled():
+                return
+            self.__set_loading(None)
+            dialog_message(title='Error Message',
+                    msg='Error: %s' % err.message, textview=False)
+            return
+        # the user might have opened another note in the meantime
+        if cancellable.is_cancelled():
+            return
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.__fill(content, 0, decoder)
+
+    # A note in the database is not a file which could be loaded by GIO, so
+    # it is read in a thread instead.
+    def __load_stored(self, filename, store, cancellable):
+        def read():
+            try:
+                with store.open(filename) as f:
+                    content = f.read()
+            except Exception as err:
+                content = err
+            GLib.idle_add(self.__loaded_stored, content, cancellable)
+
+        threading.Thread(target=read, daemon=True).start()
+
+    def __loaded_stored(self, content, cancellable):
+        if cancellable.is_cancelled():
+            return False
+        if isinstance(content, Exception):
+            self.__set_loading(None)
+            dialog_message(title='Error Message',
+                    msg='Error: %s' % content, textview=False)
+            return False
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.__fill(content, 0, decoder)
+        return False
+
+    # The line index of a huge note might have to be built first, which is
+    # done in a thread of its own.
+    def __load_preview(self, filename, cancellable):
+        self.progress.pulse()
+        cache = os.path.join(core.lines_dir, os.path.basename(filename))
+
+        def read():
+            try:
+                lines = LineIndex(filename, cache)
+            except OSError as err:
+                lines = err
+            GLib.idle_add(self.__loaded_preview, lines, cancellable)
+
+        threading.Thread(target=read, daemon=True).start()
+
+    def __loaded_preview(self, lines, cancellable):
+        if cancellable.is_cancelled():
+            if isinstance(lines, LineIndex):
+                lines.close()
+            return False
+        self.__set_loading(None)
+        if isinstance(lines, OSError):
+            dialog_message(title='Error Message',
+                    msg='Error: %s' % lines, textview=False)
+            return False
+        self.preview.show(lines)
+        self.stack.set_visible_child_name('preview')
+        self.__update_preview()
+        core.profile_add('load preview', self.load_start)
+        return False
+
+    def __modified_changed(self, text_buffer):
+        if not text_buffer.get_modified():
+            self.__cancel_autosave()
+
+    # Show the changes recovered from the journal after a crash. They have
+    # not been saved yet, so they are recorded in the new journal again.
+    def restore(self, name, content, edits):
+        self.update(name, content)
+        for (action, start, end, text) in edits:
+            if action == UndoRedoTextBuffer.INSERT:
+                self.text_buffer.insert(
+                        self.text_buffer.get_iter_at_offset(start), text)
+            else:
+                self.text_buffer.delete(
+                        self.text_buffer.get_iter_at_offset(start),
+                        self.text_buffer.get_iter_at_offset(end))
+
+    def save(self, button=None):
+        if self.loading or self.preview.lines:
+            return False
+        with core.timed('save'):
+            name = self.entry_buffer.get_text()
+            note = self.save_func(self.name, name, self.get_chunks(),
+                    core.parse_tags(self.tags_entry.get_text(), ','))
+            if not note:
+                return False
+            self.name = name
+            self.set_tags(note.tags)
+            self.filename = note.filename
+            self.content_hash = note.hash
+            self.text_buffer.set_modified(False)
+            self.journal.start(name, note.hash)
+            self.history_path = os.path.join(core.history_dir,
+                    note.filename)
+            self.text_buffer.history.save(self.history_path, note.hash)
+        return True
+
+    # The note has been renamed by another program. The new name is only
+    # shown if the user has not changed the name already.
+    def rename(self, name):
+        if self.entry_buffer.get_text() == self.name:
+            self.entry_buffer.set_text(name, -1)
+        self.name = name
+
+    # Browse the saved versions of the note. The chosen one replaces the
+    # content of the editor, which can be undone like any other change.
+    def show_history(self, button=None):
+        revisions = []
+        if self.filename and not (self.loading or self.preview.lines):
+            pack = self.revisions_func(self.filename)
+            revisions = pack.revisions()
+        if not revisions:
+            dialog_message(title='History',
+                    msg='There are no saved versions of this note to show.',
+                    textview=False)
+            return
+        dialog = Gtk.Dialog(
+                title='History of %s' % self.name,
+                parent=app_window.window,
+                modal=True,
+                destroy_with_parent=True
+                )
+        dialog.add_buttons(
+                "Close",
+                Gtk.ResponseType.CLOSE,
+                "Restore",
+                Gtk.ResponseType.ACCEPT
+                )
+        dialog.set_default_size(700, 450)
+        dialog.set_resizable(True)
+        dialog.set_transient_for(app_window.window)
+        # the newest version first
+        model = Gtk.ListStore(int, str, str)
+        for (i, (mtime_ns, size)) in reversed(list(enumerate(revisions))):
+            model.append([i, core.format_time(core.mtime_from_ns(mtime_ns)),
+                '%d bytes' % size])
+        view = Gtk.TreeView.new_with_model(model)
+        for (column, title) in ((1, 'Saved'), (2, 'Size')):
+            view.append_column(Gtk.TreeViewColumn(title,
+                Gtk.CellRendererText(), text=column))
+        text_view = Gtk.TextView.new()
+        text_view.set_cursor_visible(False)
+        text_view.set_editable(False)
+        selection = view.get_selection()
+        selection.connect('changed', self.__show_revision, pack, text_view)
+        selection.select_path(Gtk.TreePath(0))
+        paned = Gtk.Paned.new(Gtk.Orientation.HORIZONTAL)
+        subwins = []
+        for (widget, width) in ((view, 200), (text_view, 450)):
+            subwin = Gtk.ScrolledWindow()
+            subwin.add(widget)
+            subwin.set_min_content_width(width)
+            subwins.append(subwin)
+        paned.pack1(subwins[0], False, False)
+        paned.pack2(subwins[1], True, False)
+        dialog.get_content_area().pack_start(paned, True, True, 0)
+        dialog.show_all()
+        response = dialog.run()
+        text_buffer = text_view.get_buffer()
+        text = text_buffer.get_text(text_buffer.get_start_iter(),
+                text_buffer.get_end_iter(), True)
+        dialog.destroy()
+        if response == Gtk.ResponseType.ACCEPT:
+            self.text_buffer.delete(self.text_buffer.get_start_iter(),
+                    self.text_buffer.get_end_iter())
+            self.text_buffer.insert(self.text_buffer.get_start_iter(), text)
+
+    def __show_revision(self, selection, pack, text_view):
+        (model, _iter) = selection.get_selected()
+        if not _iter:
+            return
+        try:
+            content = pack.get(model[_iter][0])
+        except (OSError, ValueError, IndexError) as err:
+            content = ('Error: %s' % err).encode()
+        text_view.get_buffer().set_text(content.decode(errors='replace'))
+
+    # The tags entry is only updated if the user has not changed it already.
+    def set_tags(self, tags):
+        if not self.tags_changed():
+            self.tags_entry.set_text(core.format_tags(tags, ', '))
+        self.tags = tags
+
+    def tags_changed(self):
+        return core.parse_tags(self.tags_entry.get_text(), ',') != self.tags
+
+    def scale(self, button=None):
+        if button:
+            app_window.update_text_size(button.get_value_as_int())
+        provider = Gtk.CssProvider.new()
+        provider.load_from_data(
+                b'textview { font-size: %d%s; }' %
+                (app_window.text_size, app_window.text_size_unit.encode())
+                )
+        for textview in (self.textview, self.preview.textview):
+            textview.get_style_context().add_provider(provider,
+                    Gtk.STYLE_PROVIDER_PRIORITY_USER)
+        self.preview.redraw()
+
+    def __set_loading(self, loading):
+        self.loading = loading
+        self.textview.set_editable(not loading)
+        self.entry.set_sensitive(not loading)
+        self.tags_entry.set_sensitive(not loading)
+        self.progress.set_fraction(0)
+        self.progress.set_visible(bool(loading))
+
+    # A previewed note can neither be renamed, nor tagged, nor changed.
+    def __update_preview(self):
+        previewing = bool(self.preview.lines)
+        self.button_edit.set_visible(previewing)
+        self.entry.set_sensitive(not previewing)
+        self.tags_entry.set_sensitive(not previewing)
+        if previewing:
+            self.update_buttons(None, False, False)
+
+    def update(self, name=None, content=None):
+        self.__cancel_load()
+        if self.preview.lines:
+            self.preview.close()
+            self.stack.set_visible_child_name('editor')
+            self.__update_preview()
+        self.history_path = None
+        self.filename = None
+        self.content_hash = None
+        self.tags = frozenset()
+        self.tags_entry.set_text('')
+        if name:
+            self.entry_buffer.set_text(name, -1)
+            self.text_buffer.update(content, UndoHistory(self.worker))
+        else:
+            self.entry_buffer.delete_text(0, -1)
+            self.text_buffer.update(None, UndoHistory(self.worker))
+            self.textview.grab_focus()
+        self.text_buffer.set_modified(False)
+        self.name = self.entry_buffer.get_text()
+        self.content_hash = text_hash(content or '')
+        self.journal.start(self.name, self.content_hash)
+
+    def update_buttons(self, widget, undo, redo):
+        self.button_undo.set_sensitive(undo)
+        self.button_redo.set_sensitive(redo)
+
+
+# Measures how late the main loop runs a timeout, i.e. for how long it has
+# been blocked (see core.Timings). Only the stalls which can be noticed are
+# logged, but all of them show up in the summary.
+class Heartbeat:
+    # milliseconds
+    INTERVAL = 100
+    # seconds
+    STALL_LOG_THRESHOLD = 0.05
+
+    def __init__(self):
+        self.expected = time.perf_counter() + self.INTERVAL / 1000
+        GLib.timeout_add(self.INTERVAL, self.beat)
+
+    def beat(self):
+        now = time.perf_counter()
+        stall = max(now - self.expected, 0)
+        core.timings.add('main loop stall', stall,
+                log=stall >= self.STALL_LOG_THRESHOLD)
+        self.expected = now + self.INTERVAL / 1000
+        return True
+
+
+# A read-only view of a huge note. Only the lines currently visible are
+# read from the memory mapped file and put into the text buffer, so the size
+# of the note does not matter.
+class Preview:
+    # bytes of a single line which are shown at most
+    MAX_LINE_LENGTH = 4096
+    # lines scrolled per step of the mouse wheel
+    SCROLL_LINES = 3
+
+    def __init__(self):
+        self.lines = None
+        self.visible = 1
+        self.text_buffer = Gtk.TextBuffer()
+        self.textview = Gtk.TextView.new_with_buffer(self.text_buffer)
+        self.textview.set_cursor_visible(False)
+        self.textview.set_editable(False)
+        self.textview.set_wrap_mode(Gtk.WrapMode.NONE)
+        self.textview.connect('scroll-event', self.__scroll)
+        # only scrolled horizontally, the scrollbar next to it moves through
+        # the lines
+        subwin = Gtk.ScrolledWindow()
+        subwin.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.EXTERNAL)
+        subwin.add(self.textview)
+        subwin.connect('size-allocate', self.__resize)
+        self.adjustment = Gtk.Adjustment.new(0, 0, 0, 1, 1, 1)
+        self.adjustment.connect('value-changed', self.redraw)
+        scrollbar = Gtk.Scrollbar.new(Gtk.Orientation.VERTICAL,
+                self.adjustment)
+        self.widget = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 0)
+        self.widget.pack_start(subwin, True, True, 0)
+        self.widget.pack_start(scrollbar, False, False, 0)
+
+    def close(self):
+        self.lines.close()
+        self.lines = None
+        self.text_buffer.set_text('', -1)
+
+    def redraw(self, adjustment=None):
+        if not self.lines:
+            return
+        top = int(self.adjustment.get_value())
+        end = min(top + self.visible, len(self.lines))
+        self.text_buffer.set_text('\n'.join(
+            self.lines.line(i, self.MAX_LINE_LENGTH).decode(errors='replace')
+            for i in range(top, end)), -1)
+
+    def __resize(self, widget, allocation):
+        layout = self.textview.create_pango_layout('X')
+        (width, height) = layout.get_pixel_size()
+        visible = allocation.height // max(height, 1) + 1
+        if visible == self.visible:
+            return
+        self.visible = visible
+        self.adjustment.set_page_size(visible)
+        self.adjustment.set_page_increment(visible)
+        self.redraw()
+
+    def __scroll(self, widget, event):
+        (success, dx, dy) = event.get_scroll_deltas()
+        if not success:
+            if event.direction == Gdk.ScrollDirection.UP:
+                dy = -1
+            elif event.direction == Gdk.ScrollDirection.DOWN:
+                dy = 1
+        if not dy:
+            return False
+        self.adjustment.set_value(self.adjustment.get_value()
+                + dy * self.SCROLL_LINES)
+        return True
+
+    def show(self, lines):
+        self.lines = lines
+        self.adjustment.configure(0, 0, len(lines), 1, self.visible,
+                self.visible)
+        self.redraw()
+
+
+class UndoRedoTextBuffer(Gtk.TextBuffer):
+    # enum (the actions of an Edit)
+    INSERT = Edit.INSERT
+    DELETE = Edit.DELETE
+
+    def __init__(self):
+        super().__init__()
+        GObject.signal_new('undo-redo', self, GObject.SignalFlags.RUN_LAST,
+                GObject.TYPE_BOOLEAN,
+                [GObject.TYPE_BOOLEAN, GObject.TYPE_BOOLEAN])
+        # reports every change made by the user, including undo and redo
+        GObject.signal_new('edit', self, GObject.SignalFlags.RUN_LAST,
+                GObject.TYPE_NONE, [GObject.TYPE_INT, GObject.TYPE_INT,
+                    GObject.TYPE_INT, GObject.TYPE_STRING])
+        self.connect('insert-text', self.__insert)
+        self.connect('delete-range', self.__delete)
+        self.undo_state = False
+        self.redo_state = False
+
+    # Replace the text and the history. This is not an edit of the note, so
+    # it is neither recorded nor reported.
+    def update(self, text, history):
+        start = self.get_start_iter()
+        self.do_delete_range(self, start, self.get_end_iter())
+        if text:
+            self.do_insert_text(self, start, text, len(text.encode()))
+        self.set_history(history)
+
+    # Add text to the end of the buffer without recording it for undo.
+    def append(self, text):
+        self.do_insert_text(self, self.get_end_iter(), text, len(text.encode()))
+
+    def __delete(self, text_buffer, start_iter, end_iter):
+        text = self.get_slice(start_iter, end_iter, True)
+        start = start_iter.get_offset()
+        end = end_iter.get_offset()
+        self.history.add(self.DELETE, start, end, text)
+        self.emit('edit', self.DELETE, start, end, text)
+        self.inform(undo=True, redo=False)
+
+    def __insert(self, text_buffer, start_iter, text, length):
+        start = start_iter.get_offset()
+        end = start+len(text)
+        self.history.add(self.INSERT, start, end, text)
+        self.emit('edit', self.INSERT, start, end, text)
+        self.inform(undo=True, redo=False)
+
+    def inform(self, **kwargs):
+        if 'undo' in kwargs:
+            self.undo_state = kwargs['undo']
+        if 'redo' in kwargs:
+            self.redo_state = kwargs['redo']
+        self.emit('undo-redo', self.undo_state, self.redo_state)
+
+    def redo(self, button):
+        edit = self.history.redo()
+        start_iter = self.get_iter_at_offset(edit.start)
+        end_iter = self.get_iter_at_offset(edit.end)
+        if edit.action == self.INSERT:
+            self.do_insert_text(self, start_iter, edit.text,
+                    len(edit.text.encode()))
+        else:
+            self.do_delete_range(self, start_iter, end_iter)
+        self.emit('edit', edit.action, edit.start, edit.end, edit.text)
+        self.inform(undo=True, redo=self.history.can_redo())
+
+    def set_history(self, history):
+        self.history = history
+        self.inform(undo=history.can_undo(), redo=False)
+
+    def undo(self, button):
+        edit = self.history.undo()
+        if edit:
+            start_iter = self.get_iter_at_offset(edit.start)
+            end_iter = self.get_iter_at_offset(edit.end)
+            if edit.action == self.INSERT:
+                self.do_delete_range(self, start_iter, end_iter)
+                self.emit('edit', self.DELETE, edit.start, edit.end, edit.text)
+            else:
+                self.do_insert_text(self, start_iter, edit.text,
+                        len(edit.text.encode()))
+                self.emit('edit', self.INSERT, edit.start, edit.end, edit.text)
+        self.inform(undo=self.history.can_undo(),
+                redo=self.history.can_redo())
+
+
+# A list model which reads the rows directly from a list of notes (usually
+# the sorted notes list) when the view asks for them, instead of copying all
+# notes into a Gtk.ListStore. An iterator simply stores the position of its
+# row.
+class NotesModel(GObject.Object, Gtk.TreeModel):
+    def __init__(self, notes):
+        super().__init__()
+        self.notes = notes
+
+    def do_get_column_type(self, column):
+        return GObject.TYPE_STRING
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY
+
+    def do_get_iter(self, path):
+        indices = path.get_indices()
+        if not indices:
+            return (False, None)
+        return self.__iter_nth(indices[0])
+
+    def do_get_n_columns(self):
+        return 2
+
+    def do_get_path(self, _iter):
+        return Gtk.TreePath.new_from_indices([self.__position(_iter)])
+
+    def do_get_value(self, _iter, column):
+        note = self.notes[self.__position(_iter)]
+        return note.name if column == 0 else core.format_time(note.mtime)
+
+    def do_iter_children(self, parent):
+        if parent:
+            return (False, None)
+        return self.__iter_nth(0)
+
+    def do_iter_has_child(self, _iter):
+        return False
+
+    def do_iter_n_children(self, _iter):
+        if _iter:
+            return 0
+        return len(self.notes)
+
+    def do_iter_next(self, _iter):
+        i = self.__position(_iter) + 1
+        if i >= len(self.notes):
+            return False
+        _iter.user_data = i
+        return True
+
+    def do_iter_nth_child(self, parent, n):
+        if parent:
+            return (False, None)
+        return self.__iter_nth(n)
+
+    def do_iter_parent(self, child):
+        return (False, None)
+
+    def do_iter_previous(self, _iter):
+        i = self.__position(_iter) - 1
+        if i < 0:
+            return False
+        _iter.user_data = i
+        return True
+
+    def __iter_nth(self, n):
+        if n < 0 or n >= len(self.notes):
+            return (False, None)
+        _iter = Gtk.TreeIter()
+        _iter.user_data = n
+        return (True, _iter)
+
+    def __position(self, _iter):
+        # a NULL pointer (i.e., the first row) is read back as None
+        return _iter.user_data or 0
+
+    # Translate a change reported by Notes (see there) into the signals which
+    # tell the view about the affected rows. The notes list has already been
+    # changed at this point.
+    def update(self, event, old, new):
+        if event in (Notes.TOUCHED, Notes.RENAMED) and old == new:
+            path = Gtk.TreePath(new)
+            self.row_changed(path, self.get_iter(path))
+            return
+        if event != Notes.INSERTED:
+            self.row_deleted(Gtk.TreePath(old))
+        if event != Notes.REMOVED:
+            path = Gtk.TreePath(new)
+            self.row_inserted(path, self.get_iter(path))
+
+
+class Overview:
+    # milliseconds to wait for further keystrokes before filtering
+    FILTER_DELAY = 100
+    # notes read from an archive which may wait to be imported
+    TRANSFER_QUEUE_SIZE = 16
+    # milliseconds between two steps of an import or export (see
+    # transfer_step)
+    TRANSFER_INTERVAL = 100
+    # seconds an import may block the interface at most per step
+    TRANSFER_STEP_TIME = 0.05
+    # number of search results shown at most, the best ones
+    SEARCH_LIMIT = 1000
+
+    def __init__(self):
+        self.noteview = NoteView(self.save, self.open_revisions)
+        self.widget = self.__create()
+        # set as soon as the notes have been read in the background
+        self.notes = None
+        self.query = ''
+        # the notes found for the query (see search)
+        self.results = []
+        self.filter_text = ''
+        # the notes have to have all of these tags, or any of them
+        self.filter_tags = frozenset()
+        self.tags_any = False
+        # None to sort by name (or relevance), otherwise whether the newest
+        # notes come first (see sort)
+        self.newest_first = None
+        # the notes in the order of their modification times, if shown so
+        self.time_order = None
+        self.watcher = None
+        self.__read_notes()
+
+    def __create(self):
+        self.notes_list = self.__create_notes_list()
+        subwin = Gtk.ScrolledWindow()
+        subwin.add(self.notes_list)
+        sep = Gtk.Separator.new(Gtk.Orientation.HORIZONTAL)
+        self.filter_entry = Gtk.Entry()
+        self.filter_entry.set_placeholder_text('filter by name')
+        self.filter_entry.connect('changed', self.filter_changed)
+        self.tags_entry = Gtk.Entry()
+        self.tags_entry.set_placeholder_text('filter by tags')
+        self.tags_entry.connect('changed', self.filter_changed)
+        self.tags_any_button = Gtk.CheckButton.new_with_label('any')
+        self.tags_any_button.set_tooltip_text(
+                'show the notes with any of the tags instead of all of them')
+        self.tags_any_button.connect('toggled', self.filter_changed)
+        filter_box = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 0)
+        filter_box.pack_start(self.filter_entry, True, True, 0)
+        filter_box.pack_start(self.tags_entry, False, False, 0)
+        filter_box.pack_start(self.tags_any_button, False, False, 0)
+        self.filter_timeout = None
+        self.progress = Gtk.ProgressBar.new()
+        self.progress.set_no_show_all(True)
+        self.transfer = None
+        box = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
+        box.pack_start(self.__create_toolbar(), False, False, 0)
+        box.pack_start(self.progress, False, False, 0)
+        box.pack_start(sep, False, False, 0)
+        box.pack_start(filter_box, False, False, 0)
+        box.pack_start(subwin, True, True, 0)
+        return box
+
+    def __create_notes_list(self):
+        view = Gtk.TreeView.new()
+        view.connect('row-activated', self.open_note)
+        view.get_selection().set_mode(Gtk.SelectionMode.SINGLE)
+        # All rows have the same height, so the view does not need to measure
+        # (and therefore read) every single row.
+        view.set_fixed_height_mode(True)
+        cols = ['Note', 'Time']
+        self.columns = []
+        for i in range(2):
+            col = Gtk.TreeViewColumn(cols[i], Gtk.CellRendererText(), text = i)
+            col.set_resizable(True)
+            col.set_min_width(10)
+            col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            col.set_clickable(True)
+            col.connect('clicked', self.sort)
+            if cols[i] == 'Note':
+                col.set_expand(True)
+            else:
+                col.set_fixed_width(150)
+            view.append_column(col)
+            self.columns.append(col)
+        return view
+
+    def __create_toolbar(self):
+        button_delete = Gtk.ToolButton.new(None, 'delete')
+        button_delete.connect('clicked', self.delete_note)
+        self.button_import = Gtk.ToolButton.new(None, 'import')
+        self.button_import.connect('clicked', self.import_notes)
+        self.button_export = Gtk.ToolButton.new(None, 'export')
+        self.button_export.connect('clicked', self.export_notes)
+        search = Gtk.SearchEntry.new()
+        search.set_placeholder_text('search')
+        search.connect('search-changed', self.search)
+        search_container = Gtk.ToolItem.new()
+        search_container.add(search)
+        search_container.set_expand(True)
+        button_help = Gtk.ToolButton.new(None, 'help')
+        button_help.connect('clicked', dialog_message, 'help', help_message)
+        button_about = Gtk.ToolButton.new(None, 'about')
+        button_about.connect('clicked', about)
+        button_quit = Gtk.ToolButton.new(None, 'quit')
+        button_quit.connect('clicked', self.quit)
+        toolbar = Gtk.Toolbar.new()
+        toolbar.set_style(Gtk.ToolbarStyle.TEXT)
+        toolbar.insert(button_delete, -1)
+        toolbar.insert(self.button_import, -1)
+        toolbar.insert(self.button_export, -1)
+        toolbar.insert(search_container, -1)
+        toolbar.insert(button_help, -1)
+        toolbar.insert(button_about, -1)
+        toolbar.insert(button_quit, -1)
+        return toolbar
+
+    def delete_note(self, button):
+        (model, _iter) = self.notes_list.get_selection().get_selected()
+        if not _iter:
+            return
+        name = model[_iter][0]
+        if name == self.noteview.name:
+            dialog_message(title='Warning',
+                    msg='Error: This note is currently open', textview=False)
+            return
+        delete = dialog('Do you really want to delete %s?' % name, 
+                Gtk.ResponseType.NO)
+        if delete != 1:
+            return
+        try:
+            self.notes.note_delete(name)
+        except:
+            return
+
+    # Write all notes into an archive in the background.
+    def export_notes(self, button):
+        if not self.notes:
+            return
+        path = choose_file('Export notes', Gtk.FileChooserAction.SAVE)
+        if not path:
+            return
+        self.notes.worker.flush()
+        notes = list(self.notes.list)
+        store = self.notes.store
+        self.__start_transfer(None, len(notes))
+        transfer = self.transfer
+
+        def write():
+            try:
+                for (done, total) in core.archive_write(path, notes,
+                        store):
+                    self.transfer_progress = done / total
+            except (OSError, tarfile.TarError) as err:
+                transfer.put(err)
+                return
+            transfer.put(None)
+
+        threading.Thread(target=write, daemon=True).start()
+
+    # The archive is read in the background, while the notes are imported on
+    # the main loop (see transfer_step). The queue between them is limited,
+    # so that the notes do not pile up in memory.
+    def import_notes(self, button):
+        if not self.notes:
+            return
+        path = choose_file('Import notes', Gtk.FileChooserAction.OPEN)
+        if not path:
+            return
+        self.__start_transfer(core.Importer(self.notes))
+        transfer = self.transfer
+
+        def read():
+            try:
+                for entry in core.archive_read(path):
+                    transfer.put(entry)
+            except (OSError, tarfile.TarError) as err:
+                transfer.put(err)
+                return
+            transfer.put(None)
+
+        threading.Thread(target=read, daemon=True).start()
+
+    def open_note(self, tree_view, path, column):
+        model = tree_view.get_model()
+        name = model[path][0]
+        closed = self.noteview.close()
+        if not closed:
+            return
+        with core.timed('open_note'):
+            note = self.notes.names[name]
+            self.noteview.load(name, note.filename, self.notes.store,
+                    note.tags)
+
+    # The note which is open has been changed by another program. It is
+    # simply loaded again unless the user has changed it as well.
+    def __conflict(self):
+        filename = self.noteview.filename
+        note = self.notes.files.get(filename)
+        if not note:
+            self.noteview.filename = None
+            dialog_message(title='Warning',
+                    msg='%s has been deleted by another program.\n'
+                    'Save it to keep it.' % self.noteview.name,
+                    textview=False)
+            return
+        if not (self.noteview.loading or self.noteview.preview.lines
+                or self.noteview.text_buffer.get_modified()):
+            self.noteview.load(note.name, filename, self.notes.store,
+                    note.tags)
+            return
+        reload = dialog('%s has been changed by another program.\n'
+                'Do you like to load the changed version?\n'
+                'Otherwise, your version will replace it when saved.'
+                % note.name, Gtk.ResponseType.NO)
+        if reload == 1:
+            self.noteview.load(note.name, filename, self.notes.store,
+                    note.tags)
+        else:
+            self.noteview.content_hash = note.hash
+
+    # Called by the watcher with the files which have been changed by other
+    # programs in the meantime.
+    def files_changed(self, filenames, names_changed):
+        with core.timed('Overview.files_changed'):
+            changed = self.notes.refresh(filenames, names_changed)
+        if self.noteview.filename in changed:
+            self.__conflict()
+
+    # The latest version of the note might still have to be written.
+    def open_revisions(self, filename):
+        self.notes.worker.flush()
+        return core.RevisionPack(os.path.join(core.revisions_dir, filename))
+
+    def quit(self, widget=None, event=None):
+        close = self.noteview.check_save_state()
+        if not close:
+            # stop the event by returning True
+            return True
+        self.noteview.journal.close()
+        if self.notes:
+            self.notes.write()
+        app_window.quit()
+
+    # The window is shown before the notes have been read. The list is
+    # filled as soon as they are available.
+    def __read_notes(self):
+        def read():
+            try:
+                notes = Notes(self.update_note)
+                notes.index_titles()
+            except Exception as err:
+                GLib.idle_add(self.__read_failed, err)
+                return
+            GLib.idle_add(self.update, notes)
+
+        threading.Thread(target=read, daemon=True).start()
+
+    def __read_failed(self, err):
+        dialog_message(title='Error Message',
+                msg='Error: cannot read the notes: %s' % err, textview=False)
+        Gtk.main_quit()
+        return False
+
+    # Returns the saved note.
+    # Be aware: changing the name of a note should not create a new one, but
+    # should rename the current one. The only exception is, when the note has
+    # no name yet (i.e., the user created a new note). After giving a name to
+    # a new note, however, changing this name should result in a renaming.
+    def save(self, oldname, name, content, tags):
+        if not self.notes:
+            dialog_message(title='Error Message',
+                    msg='Error: the notes have not been read yet',
+                    textview=False)
+            return False
+        try:
+            tags = core.check_tags(tags)
+        except ValueError as err:
+            dialog_message(title='Error Message', msg='Error: %s' % err,
+                    textview=False)
+            return False
+        if not name:
+            dialog_message(title='Error Message', 
+                    msg='Error: this note has no name', textview=False)
+            return False
+        elif oldname != name and name in self.notes.names:
+            overwrite = dialog(
+                    'There already is a note with the name \'%s\'.\n'
+                    'Do you like to overwrite it?' % name, 
+                    Gtk.ResponseType.CANCEL)
+            if overwrite != 1:
+                return False
+        # the note might have been changed by another program since it has
+        # been loaded (see files_changed)
+        note = self.notes.names.get(oldname or name)
+        if (note and note.filename == self.noteview.filename
+                and note.hash != self.noteview.content_hash):
+            overwrite = dialog(
+                    '%s has been changed by another program.\n'
+                    'Do you like to overwrite it?' % note.name,
+                    Gtk.ResponseType.CANCEL)
+            if overwrite != 1:
+                return False
+        if oldname != name and oldname in self.notes.names:
+            self.notes.note_rename(oldname, name)
+        else:
+            oldname = name
+        self.notes.note_write(name, content)
+        self.notes.note_tag(name, tags)
+        return self.notes.names[name]
+
+    # The list is not filtered on every keystroke, but only after the user
+    # has stopped typing for a moment.
+    def filter_changed(self, widget):
+        if self.filter_timeout:
+            GLib.source_remove(self.filter_timeout)
+        self.filter_timeout = GLib.timeout_add(self.FILTER_DELAY,
+                self.filter)
+
+    def filter(self):
+        self.filter_timeout = None
+        self.filter_text = self.filter_entry.get_text().strip()
+        self.filter_tags = core.parse_tags(self.tags_entry.get_text(), ',')
+        self.tags_any = self.tags_any_button.get_active()
+        self.refresh()
+        return False
+
+    # Offer to restore the unsaved changes recorded in the journal of the last
+    # session, which has obviously crashed.
+    def recover(self):
+        if not self.noteview.journal.recovered:
+            return False
+        (header, edits) = self.noteview.journal.recovered
+        name = header['name']
+        content = self.notes.note_get(name) if name in self.notes.names else ''
+        # the journal only fits the content it has been started for
+        if not edits or text_hash(content) != header['hash']:
+            return False
+        restore = dialog('rnote has not been closed properly.\n'
+                'Do you like to restore the unsaved changes of %s?'
+                % (name or 'your new note'), Gtk.ResponseType.YES)
+        if restore == 1:
+            self.noteview.restore(name, content, edits)
+        return False
+
+    # Show the notes which match the search, the filter and the tags. The
+    # first of these lists determines the order, the others only restrict it.
+    def refresh(self):
+        if not self.notes:
+            return
+        lists = []
+        if self.query:
+            # some of them might have been deleted in the meantime
+            lists.append([note for note in self.results
+                if self.notes.files.get(note.filename) is note])
+        if self.filter_text:
+            lists.append(self.notes.filter(self.filter_text))
+        if self.filter_tags:
+            lists.append(self.notes.filter_tags(self.filter_tags,
+                match_all=not self.tags_any))
+        if lists:
+            notes = lists[0]
+            for matches in lists[1:]:
+                matches = set(matches)
+                notes = [note for note in notes if note in matches]
+        else:
+            notes = self.notes.list
+        with core.timed('Overview.refresh'):
+            if self.newest_first is None:
+                self.time_order = None
+            else:
+                self.time_order = TimeSortedNotes(notes, self.newest_first)
+                notes = self.time_order
+            self.notes_list.set_model(NotesModel(notes))
+
+    def search(self, entry):
+        self.query = entry.get_text().strip()
+        self.__search()
+
+    # The search runs in a thread of its own, so that typing never waits for
+    # it. The results of a query which has been changed in the meantime are
+    # dropped.
+    def __search(self):
+        if not self.notes:
+            return
+        if not self.query:
+            self.results = []
+            self.refresh()
+            return
+        (notes, query) = (self.notes, self.query)
+
+        def run():
+            with core.timed('search'):
+                results = notes.search(query, self.SEARCH_LIMIT)
+            GLib.idle_add(self.__searched, query, results)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def __searched(self, query, results):
+        if query == self.query:
+            self.results = results
+            self.refresh()
+        return False
+
+    # Clicking the time column sorts the notes by their modification times,
+    # the newest first and the oldest first on the next click. Clicking the
+    # name column restores the usual order.
+    def sort(self, column):
+        (name_column, time_column) = self.columns
+        if column == name_column:
+            self.newest_first = None
+        else:
+            self.newest_first = not self.newest_first
+        time_column.set_sort_indicator(self.newest_first is not None)
+        time_column.set_sort_order(Gtk.SortType.DESCENDING
+                if self.newest_first else Gtk.SortType.ASCENDING)
+        self.refresh()
+
+    # "importer" is None for an export of "count" notes.
+    def __start_transfer(self, importer, count=0):
+        self.transfer = queue.Queue(self.TRANSFER_QUEUE_SIZE)
+        self.transfer_progress = 0
+        self.importer = importer
+        self.transfer_count = count
+        self.button_import.set_sensitive(False)
+        self.button_export.set_sensitive(False)
+        self.progress.set_fraction(0)
+        self.progress.show()
+        GLib.timeout_add(self.TRANSFER_INTERVAL, self.transfer_step)
+
+    # The background thread puts the notes read from an archive into the
+    # queue, followed by None or the error which has stopped it. The notes
+    # imported in one step share the writes of the index and the names.
+    def transfer_step(self):
+        deadline = time.perf_counter() + self.TRANSFER_STEP_TIME
+        entry = ()
+        with self.notes.batch():
+            while time.perf_counter() < deadline:
+                try:
+                    entry = self.transfer.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None or isinstance(entry, Exception):
+                    break
+                (name, mtime_ns, data, content_hash, tags, position,
+                        size) = entry
+                self.importer.add(name, mtime_ns, data, content_hash, tags)
+                self.transfer_progress = position / size if size else 1
+        if entry is None or isinstance(entry, Exception):
+            self.__transferred(entry)
+            return False
+        self.progress.set_fraction(self.transfer_progress)
+        return True
+
+    def __transferred(self, err):
+        self.transfer = None
+        self.button_import.set_sensitive(True)
+        self.button_export.set_sensitive(True)
+        self.progress.hide()
+        if err:
+            msg = 'Error: %s' % err
+        elif self.importer:
+            msg = '%d notes imported, %d skipped as duplicates.' % (
+                    self.importer.imported, self.importer.skipped)
+        else:
+            msg = '%d notes exported.' % self.transfer_count
+        self.importer = None
+        dialog_message(title='Archive', msg=msg, textview=False)
+
+    def update(self, notes):
+        start = time.perf_counter()
+        self.notes = notes
+        self.refresh()
+        # the user might have searched already
+        self.__search()
+        # a database cannot be changed by other programs in a useful way
+        if isinstance(notes.store, core.FileStore):
+            self.watcher = Watcher(self.files_changed)
+        core.profile_add('Overview.update', start)
+        core.profile_add('note list', core.start_time)
+        report_startup()
+        self.recover()
+        return False
+
+    # Report a single change of the notes to the view, so that the selection
+    # and the scroll position stay untouched. The search results and the
+    # filtered list are simply created again.
+    def update_note(self, event, note, old, new):
+        if note.filename == self.noteview.filename:
+            if event == Notes.RENAMED:
+                self.noteview.rename(note.name)
+            elif event == Notes.TOUCHED and note.tags != self.noteview.tags:
+                self.noteview.set_tags(note.tags)
+        if self.query or self.filter_text or self.filter_tags:
+            self.refresh()
+            return
+        if self.time_order is not None:
+            (old, new) = self.time_order.update(event, note)
+        self.notes_list.get_model().update(event, old, new)
+
+
+# Watches the notes directory and the data file for changes made by other
+# programs. The events are collected for a moment, so that a burst of them
+# (e.g. a synchronisation) is handled at once, and only the files they name
+# are looked at again.
+class Watcher:
+    # milliseconds to collect events before handling them
+    DELAY = 300
+
+    def __init__(self, func):
+        self.func = func
+        self.filenames = set()
+        self.names_changed = False
+        self.timeout = None
+        self.data_name = os.path.basename(core.data_file)
+        self.monitors = []
+        for (path, callback) in ((core.notes_dir, self.__notes_changed),
+                (core.app_dir, self.__app_dir_changed)):
+            monitor = Gio.File.new_for_path(path).monitor_directory(
+                    Gio.FileMonitorFlags.WATCH_MOVES, None)
+            monitor.connect('changed', callback)
+            self.monitors.append(monitor)
+
+    def __app_dir_changed(self, monitor, gfile, other, event):
+        # the data file is replaced by renaming a temporary file
+        for f in (gfile, other):
+            if f and f.get_basename() == self.data_name:
+                self.names_changed = True
+                self.__schedule()
+
+    def __notes_changed(self, monitor, gfile, other, event):
+        for f in (gfile, other):
+            if f:
+                self.filenames.add(f.get_basename())
+        self.__schedule()
+
+    def __schedule(self):
+        if not self.timeout:
+            self.timeout = GLib.timeout_add(self.DELAY, self.flush)
+
+    def flush(self):
+        self.timeout = None
+        (filenames, self.filenames) = (self.filenames, set())
+        names_changed = self.names_changed
+        self.names_changed = False
+        self.func(filenames, names_changed)
+        return False
+
+
+def about(button):
+    dialog = Gtk.AboutDialog.new()
+    dialog.set_resizable(True)
+    dialog.set_program_name('note')
+    dialog.set_version(version_str)
+    dialog.set_copyright(copyright)
+    dialog.set_comments(description)
+    dialog.set_license(license)
+    dialog.set_logo_icon_name()
+    dialog.run()
+    dialog.destroy()
+
+
+# Raise the window when another start has handed over to us (see
+# core.Instance).
+def activate(fd, condition, instance):
+    if 'activate' in instance.accept():
+        app_window.window.present()
+    return True
+
+
+def create_gui():
+    global app_window
+
+    window = Gtk.Window.new(Gtk.WindowType.TOPLEVEL)
+    pane = Gtk.Paned.new(Gtk.Orientation.VERTICAL)
+    # track window state
+    app_window = AppWindow(window, pane)
+    overview = Overview()
+
+    window.connect('delete-event', overview.quit)
+    window.connect('size-allocate', app_window.update_size)
+    window.connect('window-state-event', app_window.update_state)
+    window.set_border_width(4)
+    window.set_position(Gtk.WindowPosition.CENTER_ALWAYS)
+    window.set_title(app_name)
+
+    pane.pack1(overview.widget, True, False)
+    pane.pack2(overview.noteview.widget, True, False)
+    pane.connect('notify::position', app_window.update_pane)
+    window.add(pane)
+
+    if core.timings:
+        Heartbeat()
+    if core.profile is not None:
+        def first_frame(widget, cr):
+            window.disconnect(handler)
+            core.profile_add('first frame', core.start_time)
+            report_startup()
+            return False
+
+        handler = window.connect('draw', first_frame)
+    window.show_all()
+
+
+# Returns the chosen path or None.
+def choose_file(title, action):
+    dialog = Gtk.FileChooserDialog(
+            title=title,
+            parent=app_window.window,
+            action=action,
+            )
+    dialog.add_buttons(
+            "Cancel",
+            Gtk.ResponseType.CANCEL,
+            "OK",
+            Gtk.ResponseType.OK
+            )
+    if action == Gtk.FileChooserAction.SAVE:
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name('notes.tar.gz')
+    response = dialog.run()
+    path = dialog.get_filename()
+    dialog.destroy()
+    return path if response == Gtk.ResponseType.OK else None
+
+
+def dialog_message(widget=None, title='', msg='', textview=True):
+    dialog = Gtk.MessageDialog(
+            title=title,
+            parent=app_window.window,
+            modal=True,
+            destroy_with_parent=True,
+            buttons=Gtk.ButtonsType.OK,
+            )
+    dialog.set_resizable(True)
+    dialog.set_transient_for(app_window.window)
+    if textview:
+        text_view = Gtk.TextView.new()
+        text_view.set_cursor_visible(False)
+        text_view.set_editable(False)
+        text_view.set_wrap_mode(Gtk.WrapMode.WORD)
+        text_view.get_buffer().set_text(msg)
+        view = Gtk.ScrolledWindow.new()
+        view.add(text_view)
+        view.set_min_content_width(500)
+        view.set_min_content_height(300)
+    else:
+        view = Gtk.Label.new(msg)
+    box = dialog.get_content_area()
+    box.pack_start(view, True, True, 0)
+    dialog.show_all()
+    dialog.run()
+    dialog.destroy()
+
+
+def dialog(msg, default_response):
+    dialog = Gtk.Dialog(
+            title='Warning',
+            parent=app_window.window,
+            modal=True,
+            destroy_with_parent=True
+            )
+    dialog.add_buttons(
+            "No",
+            Gtk.ResponseType.NO,
+            "Cancel",
+            Gtk.ResponseType.CANCEL,
+            "Yes",
+            Gtk.ResponseType.YES
+            )
+    dialog.set_default_response(default_response)
+    dialog.set_resizable(True)
+    dialog.set_transient_for(app_window.window)
+    box = dialog.get_content_area()
+    box.pack_start(Gtk.Label.new(msg), False, False, 0)
+    dialog.show_all()
+    response = dialog.run()
+    dialog.destroy()
+    if response == Gtk.ResponseType.NO:
+        return 0
+    elif response == Gtk.ResponseType.YES:
+        return 1
+    else:
+        return 2
+
+
+# Print the startup profile as soon as the window has been drawn and the
+# notes have been listed.
+def report_startup():
+    if core.profile is None:
+        return
+    names = [name for (name, duration) in core.profile]
+    if 'first frame' in names and 'note list' in names:
+        core.profile_report()
+        core.profile = None
+
+
+def main(instance=None):
+    create_gui()
+    if instance:
+        GLib.io_add_watch(instance.sock.fileno(), GLib.PRIORITY_DEFAULT,
+                GLib.IOCondition.IN, activate, instance)
+    Gtk.main()
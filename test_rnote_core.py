@@ -0,0 +1,124 @@
+# rnote - a software to take notes in a simple and convenient way
+# Copyright (C) 2019 Robert Imschweiler
+#
+# This file is part of rnote.
+#
+# rnote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rnote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rnote.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rnote_core as core
+
+
+# Applies the edits of an UndoHistory to a string, like the text buffer of
+# the editor does.
+class Text:
+    def __init__(self, history, text=''):
+        self.history = history
+        self.text = text
+
+    def __apply(self, action, edit):
+        if action == core.Edit.INSERT:
+            self.text = (self.text[:edit.start] + edit.text
+                    + self.text[edit.start:])
+        else:
+            self.text = self.text[:edit.start] + self.text[edit.end:]
+
+    def type(self, text, position=None):
+        if position is None:
+            position = len(self.text)
+        for char in text:
+            self.history.add(core.Edit.INSERT, position, position + 1, char)
+            self.text = self.text[:position] + char + self.text[position:]
+            position += 1
+
+    def redo(self):
+        edit = self.history.redo()
+        self.__apply(edit.action, edit)
+
+    def undo(self):
+        edit = self.history.undo()
+        self.__apply(core.Edit.DELETE if edit.action == core.Edit.INSERT
+                else core.Edit.INSERT, edit)
+
+
+class UndoHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.app_dir = core.app_dir
+        core.app_dir = tempfile.mkdtemp()
+        self.path = os.path.join(core.app_dir, 'history')
+        self.worker = core.Worker()
+
+    def tearDown(self):
+        self.worker.flush()
+        shutil.rmtree(core.app_dir)
+        core.app_dir = self.app_dir
+
+    # The history replayed from the log has to be the one of the session.
+    def test_reopen(self):
+        text = Text(core.UndoHistory(self.worker))
+        text.type('hello world foo')
+        content_hash = core.text_hash(text.text)
+        text.history.save(self.path, content_hash)
+        text = Text(core.UndoHistory(self.worker, self.path, content_hash),
+                text.text)
+        text.type('!')
+        text.undo()
+        text.undo()
+        self.assertEqual(text.text, 'hello world ')
+        text.redo()
+        text.redo()
+        self.assertEqual(text.text, 'hello world foo!')
+
+    # An edit which starts a new entry after everything typed since opening
+    # has been undone must not be merged into the log either.
+    def test_reopen_undone(self):
+        text = Text(core.UndoHistory(self.worker))
+        text.type('aa')
+        content_hash = core.text_hash(text.text)
+        text.history.save(self.path, content_hash)
+        text = Text(core.UndoHistory(self.worker, self.path, content_hash),
+                text.text)
+        text.type('x', 1)
+        text.undo()
+        text.type('b', 2)
+        text.undo()
+        self.assertEqual(text.text, 'aa')
+        text.undo()
+        self.assertEqual(text.text, '')
+        text.redo()
+        self.assertEqual(text.text, 'aa')
+
+    # A new note saved under the name of another one replaces its log.
+    def test_new_note_over_log(self):
+        text = Text(core.UndoHistory(self.worker))
+        text.type('old')
+        text.history.save(self.path, core.text_hash(text.text))
+        self.worker.flush()
+        text = Text(core.UndoHistory(self.worker))
+        text.type('new')
+        content_hash = core.text_hash(text.text)
+        text.history.save(self.path, content_hash)
+        text = Text(core.UndoHistory(self.worker, self.path, content_hash),
+                text.text)
+        text.undo()
+        self.assertEqual(text.text, '')
+        self.assertFalse(text.history.can_undo())
+
+
+if __name__ == '__main__':
+    unittest.main()